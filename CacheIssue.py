@@ -1,28 +1,66 @@
 import json
+import mmap
 import os
 import shutil
 import logging
+import re
 import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
 
-from Issue import Issue
+from Issue import Issue, extract_key
+from cache_projections import project
+
+# Hits acumulados tras los cuales un lector intenta (sin esperar) aplicarlos al orden LRU
+ACCESS_LOG_DRAIN_SIZE = 1024
 
 # Configuración del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler()])
 logger = logging.getLogger()
 
 class CacheIssue:
-    def __init__(self, input_dir, output_dir, write_file_prefix, server="server"):
+    def __init__(self, input_dir, output_dir, write_file_prefix, server="server", lazy=False, max_entries=None, max_bytes=None,
+                 projection=None):
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.write_file_prefix = write_file_prefix
         self.server = server
+        self.lock = threading.RLock()  # Crear un bloqueo de lectura-escritura
+        # Campos a materializar por issue (ver cache_projections); None = registro completo
+        self.projection = projection
+        # lazy=True: solo se construye el índice key -> (archivo, offset, longitud) y los
+        # issues se leen bajo demanda vía mmap; lazy=False carga todo en memoria
+        self.lazy = lazy or max_entries is not None or max_bytes is not None
+        self.index = {}
+        self.maps = {}
+        # Mapas de segmentos reemplazados por compact(): un lector puede seguir usándolos,
+        # se cierran en close()
+        self.retired_maps = []
+        # Issues leídos de los segmentos (conjunto de trabajo). Con max_entries / max_bytes
+        # se desalojan en orden LRU; un issue desalojado se vuelve a leer del segmento.
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Accesos (hits) pendientes de aplicar al orden LRU; los lectores solo hacen append
+        self.access_log = deque()
         self.copy_and_rename_files()
-        self.data = self.load_data()
+        self.data = self.load_index() if self.lazy else self.load_data()
         self.new_data = {}  # Almacenar nuevos elementos
         self.current_write_file = self.get_current_write_file()
         self.items = 0
-        self.lock = threading.RLock()  # Crear un bloqueo de lectura-escritura
+        # Escrituras a disco serializadas fuera de self.lock (los hilos de trabajo no esperan I/O)
+        self.write_lock = threading.Lock()
+        self.flusher = None
+        self.flusher_stop = False
+        self.flush_event = threading.Event()
+        self.flush_max_items = None
+        self.flush_max_interval = None
+        self.fsync_policy = 'never'
 
     def copy_and_rename_files(self):
         # Copiar archivos del directorio de salida al de entrada sin renombrar
@@ -32,75 +70,427 @@ class CacheIssue:
                 logger.info(f"Archivo {file_name} copiado al directorio de entrada")
                 os.remove(os.path.join(self.output_dir, file_name))  # Eliminar el archivo del directorio de salida
 
-    def load_data(self):
-        data = {}        
-        for file_name in os.listdir(self.input_dir):
+    def get_segment_files(self):
+        # Segmentos de este servidor ordenados por nombre (timestamp): el último gana
+        files = []
+        for file_name in sorted(os.listdir(self.input_dir)):
             if self.server not in file_name:
                 continue
-            file_path = os.path.join(self.input_dir, file_name)
-            if not os.path.isfile(file_path):
+            if not (file_name.endswith('.json') or file_name.endswith('.jsonl')):
                 continue
+            file_path = os.path.join(self.input_dir, file_name)
+            if os.path.isfile(file_path):
+                files.append(file_path)
+        return files
+
+    def load_data(self):
+        data = {}        
+        for file_path in self.get_segment_files():
             logger.info(f"Leyendo archivo: {file_path}")  # Imprime el nombre del archivo
             if file_path.endswith('.json'):
                 with open(file_path, 'r') as file:
                     try:
                         issues = json.load(file)
-                        data.update({issue['key']: Issue(issue['key'], issue['json']) for issue in issues})
+                        data.update({issue['key']: Issue(issue['key'], project(issue['json'], self.projection)) for issue in issues})
                     except json.JSONDecodeError as e:
                         logger.error(f"Error al leer el archivo JSON {file_path}: {e}")
                         continue
             elif file_path.endswith('.jsonl'):
-                with open(file_path, 'r') as file:
+                with open(file_path, 'rb') as file:
                     for line in file:
+                        if not line.strip():
+                            continue
                         try:
-                            issue = json.loads(line)
-                            data[issue['key']] = Issue(issue['key'], issue['json'])
-                        except json.JSONDecodeError as e:
+                            # Solo se extrae la key; el registro se decodifica al primer acceso
+                            issue = Issue.from_record(line, projection=self.projection)
+                            data[issue.key] = issue
+                        except (json.JSONDecodeError, KeyError) as e:
                             logger.error(f"Error al leer la línea JSON en el archivo {file_path}: {e}")
                             continue        
         return data
 
+    def load_index(self):
+        # Modo lazy: índice por segmento .jsonl (persistido en <segmento>.idx); los .json
+        # heredados no se pueden indexar por offset y se cargan completos
+        data = {}
+        for file_path in self.get_segment_files():
+            if file_path.endswith('.jsonl'):
+                for key, (offset, length) in self.load_segment_index(file_path).items():
+                    self.index[key] = (file_path, offset, length)
+                    data.pop(key, None)
+            else:
+                logger.info(f"Leyendo archivo: {file_path}")
+                with open(file_path, 'r') as file:
+                    try:
+                        for issue in json.load(file):
+                            data[issue['key']] = Issue(issue['key'], project(issue['json'], self.projection))
+                            self.index.pop(issue['key'], None)
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Error al leer el archivo JSON {file_path}: {e}")
+        logger.info(f"Índice cargado: {len(self.index)} issues en {len(self.get_segment_files())} segmentos ({self.server})")
+        return data
+
+    def load_segment_index(self, file_path):
+        index_path = file_path + '.idx'
+        stat = os.stat(file_path)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as file:
+                    stored = json.load(file)
+                if stored['size'] == stat.st_size and stored['mtime_ns'] == stat.st_mtime_ns:
+                    return stored['entries']
+            except (json.JSONDecodeError, KeyError, OSError) as e:
+                logger.error(f"Índice inválido {index_path}, se reconstruye: {e}")
+
+        logger.info(f"Indexando archivo: {file_path}")
+        entries = {}
+        offset = 0
+        with open(file_path, 'rb') as file:
+            for line in file:
+                length = len(line.rstrip(b'\r\n'))
+                if length:
+                    try:
+                        entries[extract_key(line)] = (offset, length)
+                    except (json.JSONDecodeError, KeyError) as e:
+                        logger.error(f"Error al leer la línea JSON en el archivo {file_path}: {e}")
+                offset += len(line)
+
+        # Escritura atómica del índice junto al segmento
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'entries': entries}, file)
+        os.replace(tmp_path, index_path)
+        return entries
+
+    def read_segment_record(self, file_path, offset, length):
+        segment = self.maps.get(file_path)
+        if segment is None or len(segment) < offset + length:
+            with self.lock:
+                segment = self.maps.get(file_path)
+                # El segmento activo de output_dir crece: se vuelve a mapear si hace falta.
+                # El mapa anterior no se cierra porque otro hilo puede estar leyéndolo.
+                if segment is None or len(segment) < offset + length:
+                    with open(file_path, 'rb') as file:
+                        segment = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.maps[file_path] = segment
+        return Issue.from_record(segment[offset:offset + length], projection=self.projection)
+
+    def close(self):
+        # Detiene el flusher (si existe), escribe lo pendiente y libera los segmentos
+        if self.flusher is not None:
+            self.flusher_stop = True
+            self.flush_event.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush(fsync=self.fsync_policy != 'never')
+        with self.lock:
+            for segment in list(self.maps.values()) + self.retired_maps:
+                segment.close()
+            self.maps.clear()
+            self.retired_maps = []
+
+    def compact(self, persist_projection=False):
+        # Fusiona los segmentos del directorio de entrada en uno solo, conservando solo el
+        # último registro por key. Las líneas .jsonl se copian sin volver a codificarlas,
+        # salvo con persist_projection: entonces se escribe solo la proyección de la caché.
+        persist_projection = persist_projection and self.projection is not None
+        with self.lock:
+            segments = self.get_segment_files()
+            if not segments:
+                logger.info("No hay segmentos para compactar.")
+                return {'segments': 0, 'records': 0, 'unique': 0, 'bytes_before': 0, 'bytes_after': 0, 'bytes_reclaimed': 0}
+
+            latest = {}  # key -> (archivo, offset, longitud) o dict para los .json heredados
+            records = 0
+            for file_path in segments:
+                if file_path.endswith('.jsonl'):
+                    offset = 0
+                    with open(file_path, 'rb') as file:
+                        for line in file:
+                            length = len(line.rstrip(b'\r\n'))
+                            if length:
+                                try:
+                                    latest[extract_key(line)] = (file_path, offset, length)
+                                    records += 1
+                                except (json.JSONDecodeError, KeyError) as e:
+                                    logger.error(f"Línea descartada en {file_path}: {e}")
+                            offset += len(line)
+                else:
+                    with open(file_path, 'r') as file:
+                        try:
+                            for issue in json.load(file):
+                                latest[issue['key']] = {'key': issue['key'], 'json': issue['json']}
+                                records += 1
+                        except json.JSONDecodeError as e:
+                            logger.error(f"Error al leer el archivo JSON {file_path}: {e}")
+
+            # El compactado ordena justo después del segmento más reciente, así los
+            # segmentos que lleguen después desde output_dir siguen teniendo prioridad.
+            # Cada compactación usa un nombre nuevo (_c0001, _c0002, ...): nunca se reescribe
+            # un archivo que un lector sin bloqueo pueda estar leyendo
+            base_name = os.path.splitext(os.path.basename(segments[-1]))[0]
+            match = re.match(r'^(.*)_c(\d{4})$', base_name)
+            if match:
+                base_name, generation = match.group(1), int(match.group(2)) + 1
+            else:
+                generation = 1
+            compacted_path = os.path.join(self.input_dir, f"{base_name}_c{generation:04d}.jsonl")
+            tmp_path = compacted_path + '.tmp'
+            bytes_before = sum(os.path.getsize(file_path) for file_path in segments)
+            new_index = {}
+            offset = 0
+            handles = {}
+            try:
+                with open(tmp_path, 'wb') as output:
+                    for key, location in latest.items():
+                        if isinstance(location, dict):
+                            line = json.dumps(location).encode('utf-8')
+                        else:
+                            file_path, record_offset, length = location
+                            source = handles.get(file_path)
+                            if source is None:
+                                source = handles[file_path] = open(file_path, 'rb')
+                            source.seek(record_offset)
+                            line = source.read(length)
+                        if persist_projection:
+                            projected = Issue.from_record(line, key=key, projection=self.projection).json
+                            line = Issue(key, projected).to_record()
+                        output.write(line + b'\n')
+                        new_index[key] = (offset, len(line))
+                        offset += len(line) + 1
+                    output.flush()
+                    os.fsync(output.fileno())
+            finally:
+                for source in handles.values():
+                    source.close()
+
+            # Publicación atómica del segmento y de su índice
+            os.replace(tmp_path, compacted_path)
+            stat = os.stat(compacted_path)
+            index_tmp_path = compacted_path + '.idx.tmp'
+            with open(index_tmp_path, 'w') as file:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'entries': new_index}, file)
+            os.replace(index_tmp_path, compacted_path + '.idx')
+
+            if self.lazy:
+                # El índice completo se arma aparte y se publica con una sola asignación;
+                # las entradas en segmentos de output_dir (más recientes) se conservan
+                index = {key: (compacted_path, record_offset, length) for key, (record_offset, length) in new_index.items()}
+                index.update({key: location for key, location in self.index.items() if location[0] not in segments})
+                self.index = index
+
+            # Recién ahora se retiran los segmentos reemplazados: los mapas abiertos siguen siendo
+            # válidos para los lectores en curso (se cierran en close()) y quien intente abrir un
+            # segmento ya borrado vuelve a consultar el índice nuevo
+            for file_path in segments:
+                segment = self.maps.pop(file_path, None)
+                if segment is not None:
+                    self.retired_maps.append(segment)
+                os.remove(file_path)
+                if os.path.exists(file_path + '.idx'):
+                    os.remove(file_path + '.idx')
+
+            stats = {
+                'segments': len(segments),
+                'records': records,
+                'unique': len(latest),
+                'bytes_before': bytes_before,
+                'bytes_after': stat.st_size,
+                'bytes_reclaimed': bytes_before - stat.st_size
+            }
+            logger.info(f"Compactación {self.write_file_prefix} ({self.server}): {stats}")
+            return stats
+
     def get_current_write_file(self):
         # Generar el nombre del archivo con la fecha, hora y milisegundos actuales
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         return os.path.join(self.output_dir, f"{self.write_file_prefix}_{self.server}_{timestamp}.jsonl")
 
     def get_data(self, key):
-        with self.lock:  # Adquirir el bloqueo
-            issue = self.data.get(key, None)
-        return issue if issue else None
+        # Camino de lectura sin bloqueo: get/append sobre dict, OrderedDict y deque son atómicos
+        # bajo el GIL y los escritores solo reemplazan entradas completas. El bloqueo se toma
+        # únicamente en un fallo del modo lazy (insertar en el conjunto de trabajo y desalojar).
+        issue = self.data.get(key)
+        if issue is not None or not self.lazy:
+            return issue
+
+        entry = self.resident.get(key)
+        if entry is not None:
+            self.access_log.append(key)
+            if len(self.access_log) >= ACCESS_LOG_DRAIN_SIZE and self.lock.acquire(blocking=False):
+                try:
+                    self.apply_access_log()
+                finally:
+                    self.lock.release()
+            return entry[0]
+
+        location = self.index.get(key)
+        if location is None:
+            return None
+        # Modo lazy: leer el issue del segmento y mantenerlo en el conjunto de trabajo
+        try:
+            issue = self.read_segment_record(*location)
+        except FileNotFoundError:
+            # El segmento fue reemplazado por compact() entre la consulta al índice y la lectura
+            location = self.index.get(key)
+            if location is None:
+                return None
+            issue = self.read_segment_record(*location)
+        with self.lock:
+            self.misses += 1
+            self.apply_access_log()
+            entry = self.resident.get(key)
+            if entry is None and self.index.get(key) != location:
+                # Un flush publicó una versión más nueva mientras se leía: no guardar la anterior
+                return issue
+            if entry is None:
+                self.resident[key] = (issue, location[2])
+                self.resident_bytes += location[2]
+                self.evict()
+            else:
+                issue = entry[0]
+        return issue
+
+    def apply_access_log(self):
+        # Con self.lock tomado: aplica los hits registrados por los lectores al orden LRU
+        while True:
+            try:
+                key = self.access_log.popleft()
+            except IndexError:
+                return
+            self.hits += 1
+            if key in self.resident:
+                self.resident.move_to_end(key)
+
+    def evict(self):
+        # Desalojo LRU hasta respetar el presupuesto (siempre queda al menos el último leído)
+        while len(self.resident) > 1 and (
+                (self.max_entries is not None and len(self.resident) > self.max_entries) or
+                (self.max_bytes is not None and self.resident_bytes > self.max_bytes)):
+            _, (_, size) = self.resident.popitem(last=False)
+            self.resident_bytes -= size
+            self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            self.apply_access_log()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'resident_entries': len(self.resident),
+                'resident_bytes': self.resident_bytes,
+                'pinned_entries': len(self.data),
+                'indexed_entries': len(self.index)
+            }
 
     def add_element(self, issue: Issue):
         with self.lock:  # Adquirir el bloqueo
             # Añadir el nuevo elemento al diccionario en memoria
             self.data[issue.key] = issue
             self.new_data[issue.key] = issue  # Añadir a new_data
+            pending = len(self.new_data)
+        if self.flusher is not None and pending >= self.flush_max_items:
+            self.flush_event.set()  # Despertar al flusher; la escritura no ocurre en este hilo
 
     def show_cache_count(self):
-        logger.info(f"Elementos en la caché {self.server}:  {len(self.data)}")        
+        logger.info(f"Elementos en la caché {self.server}:  {len(self.get_keys())}")        
     
     def get_keys(self):
-        keys = [str(key).strip() for key in self.data.keys()]
+        with self.lock:
+            all_keys = set(self.index) | set(self.data) if self.lazy else list(self.data.keys())
+        keys = [str(key).strip() for key in all_keys]
         return keys
 
-    def save_to_file(self):
-        with self.lock:  # Adquirir el bloqueo
-            if not self.new_data:
-                logger.info("No hay datos nuevos para guardar.")
-                return
+    def save_to_file(self, copy_raw=False):
+        # copy_raw=True: los registros que conservan su línea original se copian sin
+        # volver a codificarlos aunque se hayan leído (no deben haberse modificado)
+        if not self.new_data:
+            logger.info("No hay datos nuevos para guardar.")
+            return
+        self.flush(copy_raw=copy_raw, fsync=self.fsync_policy != 'never')
 
-            logger.info("Guardando datos en el archivo JSON... " + self.current_write_file + " (" + str(len(self.new_data)) + " elementos)")
-            # Convertir new_data a una lista de diccionarios para guardar en JSON
-            new_issues_list = [{'key': k, 'json': v.json} for k, v in self.new_data.items()]
+    def flush(self, copy_raw=False, fsync=False):
+        # Commit en grupo: se toma new_data bajo el bloqueo y se escribe fuera de él
+        with self.write_lock:
+            with self.lock:
+                pending = self.new_data
+                self.new_data = {}
+            if not pending:
+                return 0
 
-            # Guardar los nuevos datos en el archivo JSONL (JSON Lines)
-            with open(self.current_write_file, 'a') as file:
-                for issue in new_issues_list:
-                    file.write(json.dumps(issue) + '\n')
+            logger.info("Guardando datos en el archivo JSON... " + self.current_write_file + " (" + str(len(pending)) + " elementos)")
+            locations = {}
+            file_path = self.current_write_file
+            try:
+                # Guardar los nuevos datos en el archivo JSONL (JSON Lines)
+                with open(file_path, 'ab') as file:
+                    offset = file.tell()
+                    for key, issue in pending.items():
+                        record = issue.to_record(copy_raw=copy_raw)
+                        file.write(record + b'\n')
+                        locations[key] = (file_path, offset, len(record))
+                        offset += len(record) + 1
+                    file.flush()
+                    if fsync:
+                        os.fsync(file.fileno())
+            except Exception as e:
+                # Devolver lo pendiente sin pisar versiones más nuevas añadidas mientras tanto
+                # (I/O o un registro que no se pudo serializar)
+                logger.error(f"Error al guardar en {file_path}: {e}")
+                with self.lock:
+                    for key, issue in pending.items():
+                        self.new_data.setdefault(key, issue)
+                raise
 
-            # Limpiar new_data después de guardar
-            self.new_data.clear()
+            if self.lazy:
+                # Lo ya escrito pasa al índice y deja de estar fijado en memoria
+                with self.lock:
+                    for key, location in locations.items():
+                        if self.data.get(key) is pending[key]:
+                            # Primero el índice: un lector sin bloqueo siempre encuentra la key en uno de los dos
+                            self.index[key] = location
+                            # La copia del conjunto de trabajo es la versión anterior a add_element
+                            stale = self.resident.pop(key, None)
+                            if stale is not None:
+                                self.resident_bytes -= stale[1]
+                            del self.data[key]
 
             # Verificar el tamaño del archivo y actualizar current_write_file si es necesario
-            if os.path.getsize(self.current_write_file) >= 100 * 1024 * 1024:  # 100 MB
-                self.current_write_file = self.get_current_write_file()
\ No newline at end of file
+            if os.path.getsize(file_path) >= 100 * 1024 * 1024:  # 100 MB
+                if self.fsync_policy == 'rotate':
+                    fd = os.open(file_path, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                self.current_write_file = self.get_current_write_file()
+            return len(pending)
+
+    def start_flusher(self, max_items=500, max_interval=5.0, fsync_policy='group'):
+        # Hilo en segundo plano que escribe new_data cada max_items elementos o max_interval segundos.
+        # fsync_policy: 'group' (fsync en cada commit), 'rotate' (al rotar segmento / cerrar) o 'never'
+        if fsync_policy not in ('group', 'rotate', 'never'):
+            raise ValueError(f"Unsupported fsync policy: {fsync_policy}")
+        if self.flusher is not None:
+            return
+        self.flush_max_items = max_items
+        self.flush_max_interval = max_interval
+        self.fsync_policy = fsync_policy
+        self.flusher_stop = False
+        self.flusher = threading.Thread(target=self.flusher_loop, name=f"flusher-{self.write_file_prefix}-{self.server}", daemon=True)
+        self.flusher.start()
+
+    def flusher_loop(self):
+        while True:
+            self.flush_event.wait(self.flush_max_interval)
+            self.flush_event.clear()
+            stopping = self.flusher_stop
+            try:
+                self.flush(fsync=self.fsync_policy == 'group')
+            except Exception as e:
+                # flush ya devolvió el lote a new_data: se reintenta en el siguiente ciclo
+                logger.error(f"Error en el flusher de {self.write_file_prefix} ({self.server}): {e}")
+                time.sleep(1)
+            if stopping:
+                return
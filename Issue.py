@@ -1,4 +1,60 @@
+import json as jsonlib
+import re
+
+from cache_projections import project
+
+# Prefijo de los registros escritos por CacheIssue: {"key": "...", "json": ...}
+KEY_PATTERN = re.compile(rb'^\s*\{\s*"key"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def extract_key(raw):
+    # Obtiene la key de una línea JSONL sin decodificar el resto del registro
+    match = KEY_PATTERN.match(raw)
+    if match:
+        key = match.group(1)
+        return jsonlib.loads(b'"' + key + b'"') if b'\\' in key else key.decode('utf-8')
+    return jsonlib.loads(raw)['key']
+
+
 class Issue:
-    def __init__(self, key, json):
+    # raw: línea JSONL original (bytes); json se decodifica solo en el primer acceso
+    # projection: al decodificar solo se conservan esos campos y se libera la línea original
+    __slots__ = ('key', '_json', '_raw', 'projection')
+
+    def __init__(self, key, json=None, raw=None, projection=None):
         self.key = key
-        self.json = json
\ No newline at end of file
+        self._json = json
+        self._raw = raw
+        self.projection = projection
+
+    @classmethod
+    def from_record(cls, raw, key=None, projection=None):
+        raw = raw.rstrip(b'\r\n')
+        return cls(key if key is not None else extract_key(raw), raw=raw, projection=projection)
+
+    @property
+    def json(self):
+        if self._json is None and self._raw is not None:
+            decoded = jsonlib.loads(self._raw)['json']
+            if self.projection is not None:
+                decoded = project(decoded, self.projection)
+                self._raw = None
+            self._json = decoded
+        return self._json
+
+    @json.setter
+    def json(self, value):
+        self._json = value
+        self._raw = None
+
+    @property
+    def decoded(self):
+        return self._json is not None or self._raw is None
+
+    def to_record(self, copy_raw=False):
+        # Línea JSONL para escribir en un segmento. Un registro nunca decodificado se copia
+        # tal cual; uno decodificado se vuelve a codificar (pudo modificarse en memoria)
+        # salvo que copy_raw indique que solo se está copiando.
+        if self._raw is not None and (copy_raw or self._json is None):
+            return self._raw
+        return jsonlib.dumps({'key': self.key, 'json': self.json}).encode('utf-8')
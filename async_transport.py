@@ -0,0 +1,212 @@
+# async_transport.py
+#
+# Transporte asíncrono (asyncio + aiohttp) para las consultas getTests de lookUpdatedTest
+# (--engine async): un solo proceso mantiene cientos de peticiones en vuelo sin un hilo por
+# cada una. Las mutaciones y el procesamiento por test (process_keys) siguen en hilos, y las
+# lecturas de Jira Server usan el paginador concurrente de jira_service / xrayServer_service.
+
+import asyncio
+import contextvars
+import json as jsonlib
+import logging
+import os
+
+import aiohttp
+
+import xray_service
+from rate_limiter import get_client_limiter, get_host_limiter, get_retry_after
+
+# Configuración del logger
+logger = logging.getLogger('async_transport')
+
+# Máximo de peticiones en vuelo simultáneas
+MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 200))
+
+# Cliente Xray asociado a la tarea actual (equivalente asíncrono de thread_local.account)
+current_client = contextvars.ContextVar('current_client', default=None)
+
+_session = None
+_semaphore = None
+
+
+class AsyncRequestError(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class AsyncResponse:
+    # Respuesta ya leída, con la interfaz mínima de requests.Response que usa el código
+    def __init__(self, status_code, reason, text, headers, url):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = text
+        self.headers = headers
+        self.url = url
+
+    def json(self):
+        return jsonlib.loads(self.text)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code:
+            raise AsyncRequestError(f"{self.status_code} {self.reason} for url: {self.url}", response=self)
+
+
+def set_task_account(client):
+    current_client.set(client)
+
+
+def get_task_account():
+    return current_client.get()
+
+
+async def get_session():
+    global _session, _semaphore
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_IN_FLIGHT)
+        _session = aiohttp.ClientSession(connector=connector)
+        _semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+    return _session
+
+
+async def close_session():
+    global _session, _semaphore
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _semaphore = None
+
+
+def _to_aiohttp_auth(auth):
+    # Convierte requests.auth.HTTPBasicAuth en aiohttp.BasicAuth
+    if auth is None:
+        return None
+    return aiohttp.BasicAuth(auth.username, auth.password)
+
+
+async def make_request_async(url, method='GET', headers=None, json=None, params=None, auth=None):
+    if method.upper() not in ('GET', 'POST', 'PUT', 'DELETE'):
+        raise ValueError(f"Unsupported HTTP method: {method}")
+    session = await get_session()
+    async with _semaphore:
+        async with session.request(method.upper(), url, headers=headers, json=json, params=params,
+                                   auth=_to_aiohttp_auth(auth)) as response:
+            text = await response.text()
+            return AsyncResponse(response.status, response.reason, text, dict(response.headers), str(response.url))
+
+
+async def retry_request_async(func, client, *args, retries=3, delay=6, **kwargs):
+    client_id = client['id'] if isinstance(client, dict) else None
+    url = args[0] if args else kwargs.get('url')
+    limiter = get_client_limiter(client_id) if client_id else get_host_limiter(url)
+    for attempt in range(retries):
+        await limiter.acquire_async()
+        try:
+            response = await func(*args, **kwargs)
+            response.raise_for_status()
+            return response
+        except (AsyncRequestError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            response = getattr(e, 'response', None)
+            status = response.status_code if response is not None else None
+            if status == 429:
+                time_to_wait = get_retry_after(response, delay)
+                logger.warning(f"Attempt {attempt + 1} failed with error: {e}. Client ID: {client_id} Too Many Requests. Retrying in {time_to_wait} seconds...")
+                limiter.penalize(time_to_wait)
+                continue
+            elif status == 401:
+                logger.error(f"Attempt {attempt + 1} failed with error: {e}. Unauthorized. Retrying...")
+                return await func(*args, **kwargs)  # Retry without delay for authentication errors
+            elif status == 400:
+                logger.error(f"Attempt {attempt + 1} failed with error: {e}. Error 400 detected. No retry will be made.")
+                break
+            else:
+                logger.error(f"Attempt {attempt + 1} failed with error: {e}. Retrying in {delay} seconds...")
+                if response is not None:
+                    logger.error(f"Error response text: {response.text}")
+            await asyncio.sleep(delay)
+    raise Exception(f"All {retries} attempts failed or encountered a non-retryable error.")
+
+
+async def get_auth_token_async(client):
+    url = f"{xray_service.XRAY_REST_BASE_URL}/authenticate"
+    response = await retry_request_async(make_request_async, client, url, method='POST', json={
+        'client_id': client['id'],
+        'client_secret': client['secret']
+    }, retries=xray_service.RETRIES, delay=xray_service.DELAY)
+    return response.text.strip('"')
+
+
+async def send_graphql_request_async(query, variables=None, client=None, raise_on_errors=True):
+    if client is None:
+        client = get_task_account()
+
+    if client['token'] is None:
+        client['token'] = await get_auth_token_async(client)
+
+    payload = {'query': query}
+    if variables:
+        payload['variables'] = variables
+
+    limiter = get_client_limiter(client['id'])
+    attempt = 0
+    while attempt < xray_service.RETRIES:
+        await limiter.acquire_async()
+        headers = {
+            'Authorization': f'Bearer {client["token"]}',
+            'Content-Type': 'application/json'
+        }
+        response = await make_request_async(xray_service.XRAY_BASE_URL, method='POST', headers=headers, json=payload)
+        if response.status_code == 429:
+            backoff = min(get_retry_after(response, xray_service.DELAY), xray_service.MAX_BACKOFF)
+            logger.warning(f"Attempt {attempt + 1} failed with error: {response.status_code} {response.reason}. Too Many Requests. Client ID: {client['id']} Retrying in {backoff} seconds...")
+            limiter.penalize(backoff)
+            attempt += 1
+            continue
+        if response.status_code == 401:
+            client['token'] = await get_auth_token_async(client)
+            attempt += 1
+            continue
+        if response.status_code >= 400:
+            print(f"Request failed with status code {response.status_code}: {response.text}")
+            response.raise_for_status()
+
+        json_response = response.json()
+        if 'errors' in json_response and raise_on_errors:
+            print(f"Errores encontrados: {json_response['errors']}")
+            raise Exception(json_response['errors'])
+        return json_response
+
+    raise Exception(f"All {xray_service.RETRIES} attempts failed or encountered a non-retryable error.")
+
+
+async def getTestCasesUpdated_async(keys, client=None):
+    if client is None:
+        client = get_task_account()
+    borrowed = client is None
+    if borrowed:
+        client = xray_service.get_next_client()
+    query = xray_service.build_test_cases_updated_query(keys)
+    try:
+        return await send_graphql_request_async(query, client=client)
+    except Exception as e:
+        print(f"Error retrieving test cases: {e}")
+        raise e
+    finally:
+        if borrowed:
+            xray_service.release_client(client)
+
+
+async def gather_limited(coroutines, return_exceptions=False):
+    # Ejecuta las corrutinas de forma concurrente; el límite real lo impone el semáforo de transporte
+    await get_session()
+    return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+
+def run(main_coroutine):
+    # Punto de entrada sincrónico: ejecuta la corrutina y cierra la sesión al terminar
+    async def _runner():
+        try:
+            return await main_coroutine
+        finally:
+            await close_session()
+    return asyncio.run(_runner())
@@ -0,0 +1,111 @@
+# bench_cache.py
+#
+# Microbenchmark del camino de lectura de CacheIssue.get_data: lecturas/segundo según
+# el número de hilos, con un escritor concurrente.
+#   antes:   get_data bajo el RLock y escritor que mantiene el bloqueo durante el I/O
+#   después: get_data sin bloqueo y escritor con commit en grupo fuera del bloqueo
+# Uso: python bench_cache.py [--keys 20000] [--seconds 2] > bench_output.txt
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from CacheIssue import CacheIssue
+from Issue import Issue
+
+THREAD_COUNTS = [1, 2, 4, 8, 16, 25]
+WRITE_IO_SECONDS = 0.002  # Duración simulada de cada escritura a disco
+
+
+class LockedReadCache(CacheIssue):
+    # Comportamiento anterior: cada lectura toma el bloqueo de la instancia
+    def get_data(self, key):
+        with self.lock:
+            return CacheIssue.get_data(self, key)
+
+
+def create_segments(base_dir, keys):
+    input_dir = os.path.join(base_dir, 'in/')
+    output_dir = os.path.join(base_dir, 'out/')
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    with open(os.path.join(input_dir, 'testcases_server_bench.jsonl'), 'w') as file:
+        for i in range(keys):
+            file.write(json.dumps({'key': f'BENCH-{i}', 'json': {'key': f'BENCH-{i}', 'type': 'Manual'}}) + '\n')
+    return input_dir, output_dir
+
+
+def old_writer(cache, stop):
+    # save_to_file anterior: el I/O ocurría con el bloqueo tomado
+    while not stop.is_set():
+        with cache.lock:
+            time.sleep(WRITE_IO_SECONDS)
+        time.sleep(WRITE_IO_SECONDS)
+
+
+def new_writer(cache, stop):
+    counter = 0
+    while not stop.is_set():
+        cache.add_element(Issue(f'NEW-{counter}', {'key': f'NEW-{counter}'}))
+        counter += 1
+        cache.flush()
+        time.sleep(WRITE_IO_SECONDS)
+
+
+def run(cache, writer, keys, threads, seconds):
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def reader(slot):
+        rng = random.Random(slot)
+        local = 0
+        while not stop.is_set():
+            for _ in range(100):
+                cache.get_data(f'BENCH-{rng.randrange(keys)}')
+            local += 100
+        counts[slot] = local
+
+    workers = [threading.Thread(target=reader, args=(slot,)) for slot in range(threads)]
+    workers.append(threading.Thread(target=writer, args=(cache, stop)))
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    # Tiempo real: con muchos hilos el hilo principal puede despertar tarde
+    return sum(counts) / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark de lectura de CacheIssue')
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)  # Sin el log de cada commit
+
+    base_dir = tempfile.mkdtemp(prefix='bench_cache_')
+    try:
+        input_dir, output_dir = create_segments(base_dir, args.keys)
+        print(f"{'hilos':>6} {'antes (lect/s)':>16} {'después (lect/s)':>18} {'mejora':>8}")
+        for threads in THREAD_COUNTS:
+            before_cache = LockedReadCache(input_dir, output_dir, 'testcases', 'server', lazy=True)
+            before = run(before_cache, old_writer, args.keys, threads, args.seconds)
+            before_cache.close()
+            after_cache = CacheIssue(input_dir, output_dir, 'testcases', 'server', lazy=True)
+            after = run(after_cache, new_writer, args.keys, threads, args.seconds)
+            after_cache.close()
+            print(f"{threads:>6} {before:>16,.0f} {after:>18,.0f} {after / before:>7.2f}x")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bulk_association.py
+#
+# Asociación invertida (--bulk-associate): en lugar de una mutación por test
+# (addTestSetsToTest / addPreconditionsToTest) las aristas se agrupan por destino y se envía
+# addTestsToTestSet / addTestsToPrecondition con hasta BULK_ASSOCIATION_CHUNK tests cada una,
+# varias por documento GraphQL (send_graphql_batch).
+#   test -> test set: testSets.json (id_lookup)
+#   test -> precondición: campo 'precondition' de los testcases de la caché server, solo las
+#   precondiciones ya actualizadas (listas en el ledger); el resto las vincula link_test_preconditions
+#   después de actualizarlas, así una precondición que no se pudo actualizar no queda vinculada
+# Los ids de los tests en cloud salen de la caché cloud.
+
+import logging
+import os
+
+from xray_service import (
+    add_tests_to_test_set_mutation,
+    add_tests_to_precondition_mutation,
+    send_graphql_batch,
+    get_next_client,
+    release_client,
+    get_thread_local_account,
+    set_thread_local_account
+)
+from id_lookup import get_test_set_index, get_precondition_index
+from progress_ledger import get_ledger
+
+logger = logging.getLogger()
+
+BULK_ASSOCIATION_CHUNK = int(os.getenv('BULK_ASSOCIATION_CHUNK', 100))
+
+
+def collect_edges(keys, cache_server, cache_cloud, ambiente):
+    # Devuelve ({test_set_id: {test_id: key}}, {precondition_id: {test_id: key}})
+    test_set_index = get_test_set_index()
+    precondition_index = get_precondition_index()
+    ledger = get_ledger()
+    test_sets = {}
+    preconditions = {}
+    for key in keys:
+        cloud = cache_cloud.get_data(key)
+        if not cloud:
+            continue
+        test_id = cloud.json['id']
+        for test_set_id in test_set_index.get(key, ambiente, []):
+            if test_set_id:
+                test_sets.setdefault(str(test_set_id), {})[test_id] = key
+        server = cache_server.get_data(key)
+        for precondition in (server.json.get('precondition') or []) if server else []:
+            if not ledger.is_precondition_ready(precondition.get('preconditionKey')):
+                continue
+            precondition_id = precondition_index.get(precondition.get('preconditionKey'), ambiente)
+            if precondition_id:
+                preconditions.setdefault(str(precondition_id), {})[test_id] = key
+    return test_sets, preconditions
+
+
+def send_grouped(edges, build_mutation, kind, chunk_size):
+    # Una mutación por destino y bloque de tests; devuelve {key: destinos que fallaron}
+    mutations = []
+    chunks = []
+    for target_id, tests in edges.items():
+        test_ids = list(tests)
+        for i in range(0, len(test_ids), chunk_size):
+            chunk = test_ids[i:i + chunk_size]
+            mutations.append(build_mutation(target_id, chunk))
+            chunks.append((target_id, [tests[test_id] for test_id in chunk]))
+
+    failed = {}
+    ledger = get_ledger()
+    # Cada destino es independiente: un id inválido no debe dejar sin enviar a los demás
+    for result, (target_id, keys) in zip(send_graphql_batch(mutations, continue_on_error=True), chunks):
+        if result['errors']:
+            for key in keys:
+                failed.setdefault(key, set()).add(target_id)
+            ledger.record_error(kind, target_id, f"Error associating {len(keys)} tests: {result['errors']}")
+    logger.info(f"Asociación masiva {kind}: {len(edges)} destinos, {len(mutations)} mutaciones, {len(failed)} tests con error")
+    return failed, len(mutations)
+
+
+def associate_in_bulk(keys, cache_server, cache_cloud, ambiente, chunk_size=None):
+    chunk_size = chunk_size or BULK_ASSOCIATION_CHUNK
+    test_sets, preconditions = collect_edges(keys, cache_server, cache_cloud, ambiente)
+
+    client = get_thread_local_account()
+    borrowed = client is None
+    if borrowed:
+        set_thread_local_account(get_next_client())
+    try:
+        test_sets_failed, test_set_mutations = send_grouped(test_sets, add_tests_to_test_set_mutation, 'test_set', chunk_size)
+        preconditions_failed, precondition_mutations = send_grouped(preconditions, add_tests_to_precondition_mutation, 'precondition', chunk_size)
+    finally:
+        if borrowed:
+            release_client(get_thread_local_account())
+            set_thread_local_account(None)
+
+    # Precondiciones vinculadas en bloque por test: link_test_preconditions no las repite y
+    # vincula una a una las que fallaron en bloque
+    preconditions_linked = {}
+    for precondition_id, tests in preconditions.items():
+        for key in tests.values():
+            if precondition_id not in preconditions_failed.get(key, ()):
+                preconditions_linked.setdefault(key, set()).add(precondition_id)
+
+    return {
+        'keys': set(keys),
+        'test_sets_failed': set(test_sets_failed),
+        'preconditions_linked': preconditions_linked,
+        'mutations': test_set_mutations + precondition_mutations
+    }
@@ -0,0 +1,170 @@
+# bulk_import.py
+#
+# Motor alternativo (--bulk-import) para la primera migración de proyectos completos: en lugar
+# de varias mutaciones GraphQL por test, los tests de la caché server se convierten al formato
+# de importación masiva de Xray Cloud y se envían en lotes a la API REST:
+#   POST {XRAY_REST_BASE_URL}/import/test/bulk               -> {"jobId": "..."}
+#   GET  {XRAY_REST_BASE_URL}/import/test/bulk/{jobId}/status -> estado y resultado del job
+# Cada test se importa con update_key (la key ya existe en cloud), así se actualiza tipo,
+# pasos y definición. Los resultados se concilian en el ledger de progreso: los importados
+# quedan como actualizados (test sets y precondiciones siguen por las etapas normales) y los
+# rechazados como error. Con XRAY_REST_BASE_URL apuntando a xray_import_standin.py se prueba
+# sin Xray Cloud.
+
+import logging
+import os
+import time
+
+from retry_util import retry_request, make_request
+from xray_service import (
+    XRAY_REST_BASE_URL,
+    RETRIES,
+    DELAY,
+    get_auth_token,
+    get_next_client,
+    release_client
+)
+from progress_ledger import get_ledger
+
+logger = logging.getLogger()
+
+BULK_IMPORT_BATCH = int(os.getenv('BULK_IMPORT_BATCH', 1000))  # Máximo de tests por job que admite la API
+BULK_IMPORT_POLL_SECONDS = float(os.getenv('BULK_IMPORT_POLL_SECONDS', 2))
+BULK_IMPORT_TIMEOUT = float(os.getenv('BULK_IMPORT_TIMEOUT', 900))
+
+FINISHED_STATUSES = ('successful', 'partially_successful', 'failed', 'unsuccessful')
+
+
+def to_import_test(testServer):
+    # Test de la caché server -> elemento del JSON de importación masiva
+    key = testServer['key']
+    test_type = testServer.get('type')
+    fields = {'project': {'key': key.rsplit('-', 1)[0]}}
+    if testServer.get('summary'):
+        fields['summary'] = testServer['summary']
+
+    test = {'testtype': test_type, 'update_key': key, 'fields': fields}
+    if test_type == 'Manual':
+        test['steps'] = [{
+            'action': step.get('fields').get('Action') or '',
+            'data': step.get('fields').get('Data') or '',
+            'result': step.get('fields').get('ExpectedResult') or ''
+        } for step in testServer.get('steps') or []]
+    elif test_type == 'Cucumber':
+        test['gherkin_def'] = testServer.get('definition') or ''
+    else:
+        test['unstructured_def'] = testServer.get('definition') or ''
+    return test
+
+
+def auth_headers(client):
+    if client['token'] is None:
+        client['token'] = get_auth_token(client)
+    return {'Authorization': f"Bearer {client['token']}", 'Content-Type': 'application/json'}
+
+
+def submit_batch(tests, client):
+    url = f"{XRAY_REST_BASE_URL}/import/test/bulk"
+    print(f"Importando {len(tests)} tests: {url}")
+    response = retry_request(make_request, client, url, method='POST', headers=auth_headers(client), json=tests,
+                             client_id=client['id'], retries=RETRIES, delay=DELAY)
+    return response.json()['jobId']
+
+
+def get_job_status(job_id, client):
+    url = f"{XRAY_REST_BASE_URL}/import/test/bulk/{job_id}/status"
+    # El estado cambia en cada consulta: no pasar por la caché HTTP
+    response = retry_request(make_request, client, url, method='GET', headers=auth_headers(client),
+                             client_id=client['id'], cache=False, retries=RETRIES, delay=DELAY)
+    return response.json()
+
+
+def wait_for_jobs(jobs, client):
+    # jobs: {jobId: [keys en el orden enviado]}; devuelve {jobId: estado final}
+    pending = set(jobs)
+    results = {}
+    deadline = time.monotonic() + BULK_IMPORT_TIMEOUT
+    while pending:
+        for job_id in list(pending):
+            try:
+                status = get_job_status(job_id, client)
+            except Exception as e:
+                # Sin estado del job: sus tests quedan con error al conciliar
+                logger.error(f"Error consultando el job {job_id}: {e}")
+                status = {'status': 'error', 'message': str(e), 'result': {}}
+            if status.get('status') in FINISHED_STATUSES + ('error',):
+                results[job_id] = status
+                pending.discard(job_id)
+        if pending:
+            if time.monotonic() > deadline:
+                for job_id in pending:
+                    results[job_id] = {'status': 'timeout', 'result': {}}
+                break
+            time.sleep(BULK_IMPORT_POLL_SECONDS)
+    return results
+
+
+def reconcile(keys, status, ledger):
+    # Concilia el resultado de un job con el ledger; devuelve (importadas, con error)
+    result = status.get('result') or {}
+    imported = set()
+    failed = {}
+    for issue in result.get('issues', []):
+        imported.add(keys[issue['elementNumber']])
+    for error in result.get('errors', []):
+        failed[keys[error['elementNumber']]] = str(error.get('errors'))
+    if status.get('status') != 'successful':
+        # Job fallido o sin terminar: los tests sin resultado explícito quedan con error
+        for key in keys:
+            if key not in imported and key not in failed:
+                failed[key] = f"Bulk import {status.get('status')}: {result.get('message') or status.get('message')}"
+
+    for key in imported:
+        ledger.mark_test_updated(key)
+    for key, error in failed.items():
+        ledger.mark_test_error(key, f"Error en importación masiva: {error}")
+    return imported, failed
+
+
+def bulk_import_tests(keys, cache_server, batch_size=None):
+    # Importa los tests indicados que aún no están listos ni actualizados
+    batch_size = batch_size or BULK_IMPORT_BATCH
+    ledger = get_ledger()
+    tests = []
+    for key in keys:
+        if ledger.is_test_ready(key) or ledger.is_test_updated(key):
+            continue
+        testServer = cache_server.get_data(key)
+        if testServer:
+            tests.append(to_import_test(testServer.json))
+    if not tests:
+        return set(), {}
+
+    imported = set()
+    failed = {}
+    client = get_next_client()
+    try:
+        # Se envían todos los lotes y luego se espera a los jobs (Xray los procesa en paralelo)
+        jobs = {}
+        for i in range(0, len(tests), batch_size):
+            batch = tests[i:i + batch_size]
+            batch_keys = [test['update_key'] for test in batch]
+            try:
+                jobs[submit_batch(batch, client)] = batch_keys
+            except Exception as e:
+                # Lote no aceptado: sus tests quedan con error y siguen por mutaciones
+                logger.error(f"Error enviando lote de {len(batch)} tests a importación masiva: {e}")
+                for key in batch_keys:
+                    failed[key] = str(e)
+                    ledger.mark_test_error(key, f"Error en importación masiva: {e}")
+        statuses = wait_for_jobs(jobs, client)
+    finally:
+        release_client(client)
+
+    for job_id, status in statuses.items():
+        job_imported, job_failed = reconcile(jobs[job_id], status, ledger)
+        imported |= job_imported
+        failed.update(job_failed)
+        logger.info(f"Job {job_id}: {status.get('status')} ({len(job_imported)} importados, {len(job_failed)} con error)")
+    ledger.export_json()
+    return imported, failed
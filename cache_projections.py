@@ -0,0 +1,39 @@
+# cache_projections.py
+#
+# Proyecciones declarativas por nombre de caché: solo se materializan los campos del
+# registro server que usa la migración. True = conservar el valor completo; un dict
+# selecciona subcampos (en listas se aplica a cada elemento).
+
+PROJECTIONS = {
+    "testcases": {
+        "key": True,
+        "summary": True,  # Solo lo usa la importación masiva (bulk_import); se omite si no existe
+        "type": True,
+        "definition": True,
+        "steps": {
+            "fields": {
+                "Action": True,
+                "Data": True,
+                "ExpectedResult": True
+            }
+        },
+        "precondition": True
+    }
+}
+
+
+def project(value, spec):
+    if spec is True or spec is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {field: project(value[field], sub_spec) for field, sub_spec in spec.items() if field in value}
+    return value
+
+
+def get_projection(cache_name, server="server"):
+    # Solo los registros de Jira/Xray Server se proyectan
+    if server != "server":
+        return None
+    return PROJECTIONS.get(cache_name)
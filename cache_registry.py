@@ -0,0 +1,79 @@
+# cache_registry.py
+#
+# Registro de cachés compartido entre las fases de una ejecución: cada CacheIssue se abre
+# en el primer uso (una sola vez aunque varios hilos lo pidan a la vez) y las cachés
+# necesarias se pueden precargar en paralelo con warm().
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from CacheIssue import CacheIssue
+from cache_projections import get_projection
+
+
+class CacheRegistry:
+    def __init__(self, cache_paths, lazy=True, max_entries=None, max_bytes=None, flusher=False):
+        self.cache_paths = cache_paths
+        self.lazy = lazy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flusher = flusher
+        self.caches = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def open_cache(self, name, server):
+        path = self.cache_paths[name]
+        cache = CacheIssue(f'{path}in/', f'{path}out/', name, server, lazy=self.lazy,
+                           max_entries=self.max_entries, max_bytes=self.max_bytes,
+                           projection=get_projection(name, server))
+        if self.flusher:
+            # Persistir en segundo plano lo que se agregue a la caché durante la ejecución
+            cache.start_flusher()
+        return cache
+
+    def get(self, name, server="server"):
+        key = (name, server)
+        cache = self.caches.get(key)
+        if cache is not None:
+            return cache
+
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.pending[key] = future
+
+        if owner:
+            try:
+                cache = self.open_cache(name, server)
+            except Exception as e:
+                with self.lock:
+                    del self.pending[key]
+                future.set_exception(e)
+                raise
+            self.caches[key] = cache
+            future.set_result(cache)
+            return cache
+
+        # Otro hilo la está abriendo: esperar su resultado
+        return future.result()
+
+    def warm(self, names, servers=("server", "cloud")):
+        # Carga en paralelo las cachés indicadas (las ya abiertas no se vuelven a cargar)
+        keys = [(name, server) for name in names for server in servers]
+        with ThreadPoolExecutor(max_workers=max(1, len(keys))) as executor:
+            futures = {key: executor.submit(self.get, *key) for key in keys}
+        return {key: future.result() for key, future in futures.items()}
+
+    def opened(self):
+        return list(self.caches.keys())
+
+    def close_all(self):
+        with self.lock:
+            caches = list(self.caches.values())
+            self.caches.clear()
+            self.pending.clear()
+        for cache in caches:
+            cache.close()
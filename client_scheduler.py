@@ -0,0 +1,73 @@
+# client_scheduler.py
+
+import threading
+from rate_limiter import get_client_limiter
+
+
+class ClientScheduler:
+    # Reparte los clientes Xray según el presupuesto disponible en su token bucket,
+    # evitando los que están en pausa por un 429 y penalizando a los más limitados.
+    def __init__(self, clients):
+        self.clients = clients
+        self.lock = threading.Lock()
+        self.assigned = {client['id']: 0 for client in clients}
+        self.handed_out = {client['id']: 0 for client in clients}
+        self.rebalanced = {client['id']: 0 for client in clients}
+
+    def _score(self, client):
+        limiter = get_client_limiter(client['id'])
+        # Presupuesto: tokens disponibles más lo que se recarga en un segundo,
+        # repartido entre los hilos que ya trabajan con este cliente
+        budget = limiter.available() + limiter.rate
+        throttle_ratio = limiter.throttled / max(1, limiter.acquired)
+        return budget / (1 + self.assigned[client['id']]) / (1 + 10 * throttle_ratio)
+
+    def _pick(self, exclude=None):
+        candidates = [client for client in self.clients if client['id'] != exclude] or self.clients
+        ready = [client for client in candidates if get_client_limiter(client['id']).backoff_remaining() == 0]
+        if not ready:
+            # Todos en pausa: el que termine antes su backoff
+            return min(candidates, key=lambda client: get_client_limiter(client['id']).backoff_remaining())
+        return max(ready, key=self._score)
+
+    def acquire(self):
+        with self.lock:
+            client = self._pick()
+            self.assigned[client['id']] += 1
+            self.handed_out[client['id']] += 1
+            return client
+
+    def release(self, client):
+        if client is None:
+            return
+        with self.lock:
+            if self.assigned[client['id']] > 0:
+                self.assigned[client['id']] -= 1
+
+    def reassign(self, client):
+        # El cliente recibió un 429: liberar y entregar otro con más presupuesto si lo hay
+        with self.lock:
+            if self.assigned[client['id']] > 0:
+                self.assigned[client['id']] -= 1
+            new_client = self._pick(exclude=client['id'])
+            self.assigned[new_client['id']] += 1
+            self.handed_out[new_client['id']] += 1
+            if new_client['id'] != client['id']:
+                self.rebalanced[client['id']] += 1
+            return new_client
+
+    def utilization(self):
+        with self.lock:
+            stats = {}
+            for client in self.clients:
+                limiter = get_client_limiter(client['id'])
+                stats[client['id']] = {
+                    'assigned': self.assigned[client['id']],
+                    'handed_out': self.handed_out[client['id']],
+                    'requests': limiter.acquired,
+                    'throttled': limiter.throttled,
+                    'rebalanced': self.rebalanced[client['id']],
+                    'available_tokens': round(limiter.available(), 2),
+                    'backoff_remaining': round(limiter.backoff_remaining(), 2)
+                }
+            return stats
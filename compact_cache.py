@@ -0,0 +1,40 @@
+# compact_cache.py
+#
+# Compacta los segmentos de una caché: un solo .jsonl con el último registro por key.
+# Uso: python compact_cache.py /tmp/testcase/ --prefix testcases --server server cloud [--project]
+
+import argparse
+import os
+
+from CacheIssue import CacheIssue
+from cache_projections import get_projection
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compactación de segmentos de CacheIssue')
+    parser.add_argument('paths', nargs='+', help='Directorios de caché (con subdirectorios in/ y out/)')
+    parser.add_argument('--prefix', type=str, required=True, help='Prefijo de los segmentos (testcases, testsets, ...)')
+    parser.add_argument('--server', nargs='+', default=['server', 'cloud'], help='Origen: server y/o cloud')
+    parser.add_argument('--project', action='store_true', help='Persistir solo los campos de la proyección de la caché')
+    return parser.parse_args()
+
+
+def compact_paths(paths, prefix, servers, persist_projection=False):
+    total_reclaimed = 0
+    for path in paths:
+        for server in servers:
+            # lazy=True: solo se indexan los segmentos, no se decodifican los issues
+            cache = CacheIssue(os.path.join(path, 'in/'), os.path.join(path, 'out/'), prefix, server, lazy=True,
+                               projection=get_projection(prefix, server))
+            stats = cache.compact(persist_projection=persist_projection)
+            cache.close()
+            total_reclaimed += stats['bytes_reclaimed']
+            print(f"{path} [{server}]: {stats['segments']} segmentos, {stats['records']} registros -> {stats['unique']} únicos, "
+                  f"{stats['bytes_reclaimed'] / (1024 * 1024):.2f} MB recuperados")
+    print(f"Total recuperado: {total_reclaimed / (1024 * 1024):.2f} MB")
+    return total_reclaimed
+
+
+if __name__ == "__main__":
+    args = get_args()
+    compact_paths(args.paths, args.prefix, args.server, args.project)
@@ -1,16 +1,39 @@
 # config.py
 
-import argparse
+# Argumentos expuestos como config.<nombre>; se leen de sys.argv en el primer acceso
+ARG_NAMES = ('ambiente', 'sort', 'process', 'engine', 'incremental', 'pipeline', 'bulk_associate', 'bulk_import', 'bulk_import_limit')
 
-def get_args():
+def get_args(argv=None):
+    import argparse  # Solo se necesita al parsear; mantiene barato el import de config
     parser = argparse.ArgumentParser(description='Descripción de tu script')
     parser.add_argument('--ambiente', type=str, help='Ambiente (DEV o PROD)', required=True)
     parser.add_argument('--sort', type=str)
     parser.add_argument('--process', type=str)
-    return parser.parse_args()
+    parser.add_argument('--engine', type=str, choices=['threads', 'async'], default='threads',
+                        help='Motor de las consultas getTests de cloud: threads (ThreadPoolExecutor) o async (asyncio/aiohttp)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Solo consultar los tests que cambiaron desde la última sincronización')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Procesar los tests en un pipeline por etapas con colas acotadas')
+    parser.add_argument('--bulk-associate', action='store_true',
+                        help='Vincular test sets y precondiciones en bloque por destino (addTestsToTestSet/addTestsToPrecondition)')
+    parser.add_argument('--bulk-import', action='store_true',
+                        help='Migrar tipo, pasos y definición con la importación masiva de Xray Cloud (REST)')
+    parser.add_argument('--bulk-import-limit', type=int, default=None,
+                        help='Máximo de tests por ejecución en --bulk-import (por defecto todos los filtrados)')
+    return parser.parse_args(argv)
 
-# Variables globales
-args = get_args()
-ambiente = args.ambiente
-sort = args.sort
-process = args.process
+def load(argv=None):
+    # Variables globales (los valores asignados explícitamente, p. ej. config.process = [], se respetan)
+    global args
+    args = get_args(argv)
+    for name in ARG_NAMES:
+        globals().setdefault(name, getattr(args, name))
+    return args
+
+def __getattr__(name):
+    # Importar config no parsea argv: se hace al leer el primer argumento
+    if name == 'args' or name in ARG_NAMES:
+        load()
+        return globals()[name]
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
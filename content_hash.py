@@ -0,0 +1,64 @@
+# content_hash.py
+#
+# Estado normalizado de un test en server y en cloud para comparar antes de mutar.
+# Los textos se normalizan con escape_definition_text (el mismo escape que usan las
+# mutaciones), así un texto ya migrado produce el mismo hash en ambos lados.
+# Cada parte del test (tipo, definición, pasos, precondiciones, test sets) se compara por
+# separado para que solo las partes distintas generen mutaciones.
+
+import hashlib
+import json
+
+from xray_service import escape_definition_text
+from id_lookup import get_precondition_index, get_test_set_index
+
+
+def text_hash(*values):
+    normalized = json.dumps([escape_definition_text(value) for value in values])
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def ids(values):
+    return frozenset(str(value) for value in values if value)
+
+
+def server_state(testServer, ambiente):
+    test_type = testServer.get('type')
+    steps = testServer.get('steps') or []
+    return {
+        'type': test_type,
+        'definition': None if test_type == 'Manual' else text_hash(testServer.get('definition')),
+        'steps': [text_hash(step.get('fields').get('Action'), step.get('fields').get('Data'),
+                            step.get('fields').get('ExpectedResult')) for step in steps],
+        'preconditions': ids(get_precondition_index().get(precondition.get('preconditionKey'), ambiente)
+                             for precondition in testServer.get('precondition') or []),
+        'test_sets': ids(get_test_set_index().get(testServer.get('key'), ambiente, []))
+    }
+
+
+def cloud_state(testcase):
+    # testcase: resultado de getTests (build_test_cases_updated_query)
+    test_type = (testcase.get('testType') or {}).get('name')
+    definition = testcase.get('gherkin') if test_type == 'Cucumber' else testcase.get('unstructured')
+    return {
+        'type': test_type,
+        'definition': None if test_type == 'Manual' else text_hash(definition),
+        'steps': [text_hash(step.get('action'), step.get('data'), step.get('result')) for step in testcase.get('steps') or []],
+        'preconditions': ids(p.get('issueId') for p in (testcase.get('preconditions') or {}).get('results', [])),
+        'test_sets': ids(t.get('issueId') for t in (testcase.get('testSets') or {}).get('results', []))
+    }
+
+
+def body_hash(state):
+    # Hash de tipo + definición + pasos (lo que migran las mutaciones del test)
+    content = json.dumps([state['type'], state['definition'], state['steps']])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def missing_steps(server, cloud):
+    # Pasos del server que faltan en cloud. Si cloud tiene un prefijo de los pasos (ejecución
+    # anterior cortada a mitad) solo faltan los siguientes. Si cloud tiene otros pasos devuelve
+    # None: añadir todos duplicaría los que ya están.
+    if server['steps'][:len(cloud['steps'])] == cloud['steps']:
+        return range(len(cloud['steps']), len(server['steps']))
+    return None
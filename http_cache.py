@@ -0,0 +1,182 @@
+# http_cache.py
+#
+# Caché persistente de respuestas GET (por defecto en /tmp/urls/, la ruta "urls" de cache_paths).
+# Se guarda el cuerpo junto con ETag/Last-Modified y cada uso se revalida con
+# If-None-Match/If-Modified-Since; un 304 reutiliza el cuerpo. Solo con HTTP_CACHE_TTL > 0 se
+# responde desde la caché sin ir a la red durante esos segundos (puede servir datos ya cambiados).
+# Las entradas más antiguas que HTTP_CACHE_MAX_AGE se borran y, si se supera HTTP_CACHE_MAX_BYTES,
+# se desalojan las menos usadas recientemente. La clave incluye un hash de la autenticación,
+# así una respuesta nunca se sirve a otras credenciales.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+HTTP_CACHE_ENABLED = os.getenv('HTTP_CACHE_ENABLED', '1') == '1'
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', '/tmp/urls/')
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', 0))  # 0 = revalidar siempre
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 7 * 24 * 3600))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+EVICT_EVERY = 200  # Escrituras entre pasadas de desalojo
+
+
+def auth_fingerprint(headers, auth):
+    credentials = (headers or {}).get('Authorization') or ''
+    if auth is not None:
+        # HTTPBasicAuth no tiene un repr estable: se usan sus credenciales
+        credentials += repr((getattr(auth, 'username', None), getattr(auth, 'password', None))) if hasattr(auth, 'username') else repr(auth)
+    return hashlib.sha256(credentials.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_key(url, params, headers, auth):
+    params = sorted((params or {}).items())
+    accept = (headers or {}).get('Accept', '')
+    raw = json.dumps([url, params, accept, auth_fingerprint(headers, auth)], default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def build_response(url, status_code, headers, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.url = url
+    response.encoding = 'utf-8'
+    return response
+
+
+class HttpCache:
+    def __init__(self, directory=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, max_age=HTTP_CACHE_MAX_AGE, max_bytes=HTTP_CACHE_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.stats_lock = threading.Lock()  # Los contadores se actualizan desde varios hilos
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(os.path.join(directory, 'responses.db'), check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+
+    def lookup(self, key):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT etag, last_modified, headers, body, stored_at FROM responses WHERE key = ?', (key,)).fetchone()
+
+    def store(self, key, url, response):
+        if response.status_code != 200 or 'no-store' in response.headers.get('Cache-Control', ''):
+            return
+        body = response.content
+        now = time.time()
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() in ('content-type', 'etag', 'last-modified')}
+        with self.lock:
+            self.conn.execute('''
+                INSERT INTO responses (key, url, etag, last_modified, headers, body, size, stored_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET url = excluded.url, etag = excluded.etag, last_modified = excluded.last_modified,
+                    headers = excluded.headers, body = excluded.body, size = excluded.size,
+                    stored_at = excluded.stored_at, accessed_at = excluded.accessed_at
+            ''', (key, url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                  json.dumps(headers), body, len(body), now, now))
+            self.writes += 1
+            if self.writes % EVICT_EVERY == 0:
+                self.evict()
+
+    def touch(self, key, refreshed=False):
+        now = time.time()
+        with self.lock:
+            if refreshed:
+                self.conn.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            else:
+                self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+
+    def evict(self):
+        # Llamar con self.lock tomado
+        self.conn.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - self.max_age,))
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def get(self, session, url, headers=None, params=None, auth=None):
+        key = cache_key(url, params, headers, auth)
+        cached = self.lookup(key)
+        if cached is not None:
+            etag, last_modified, stored_headers, body, stored_at = cached
+            if time.time() - stored_at < self.ttl:
+                with self.stats_lock:
+                    self.hits += 1
+                self.touch(key)
+                return build_response(url, 200, json.loads(stored_headers), body)
+
+            # Revalidar con una petición condicional
+            conditional = dict(headers or {})
+            if etag:
+                conditional['If-None-Match'] = etag
+            if last_modified:
+                conditional['If-Modified-Since'] = last_modified
+            response = session.get(url, headers=conditional, params=params, auth=auth)
+            if response.status_code == 304:
+                with self.stats_lock:
+                    self.revalidated += 1
+                self.touch(key, refreshed=True)
+                return build_response(url, 200, json.loads(stored_headers), body)
+        else:
+            response = session.get(url, headers=headers, params=params, auth=auth)
+
+        with self.stats_lock:
+            self.misses += 1
+        self.store(key, url, response)
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            entries, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        with self.stats_lock:
+            return {'entries': entries, 'bytes': size, 'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HttpCache()
+    return _http_cache
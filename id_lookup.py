@@ -0,0 +1,83 @@
+# id_lookup.py
+#
+# Índices key -> id (idDEV / idPROD) para preconditions.json y testSets.json.
+# Se construyen una sola vez (al primer uso) y se comparten entre hilos y scripts.
+
+import json
+import threading
+
+PRECONDITIONS_FILE = 'preconditions.json'
+TEST_SETS_FILE = 'testSets.json'
+AMBIENTES = ('DEV', 'PROD')
+
+
+class IdIndex:
+    def __init__(self, ids_by_ambiente):
+        # {'DEV': {key: value}, 'PROD': {key: value}}
+        self.ids_by_ambiente = ids_by_ambiente
+
+    def get(self, key, ambiente, default=None):
+        return self.ids_by_ambiente.get(ambiente, {}).get(key, default)
+
+    def resolve(self, keys, ambiente):
+        # Resolución masiva: {key: id} solo para las keys encontradas
+        ids = self.ids_by_ambiente.get(ambiente, {})
+        return {key: ids[key] for key in keys if key in ids}
+
+    def keys(self):
+        keys = set()
+        for ids in self.ids_by_ambiente.values():
+            keys.update(ids)
+        return keys
+
+    def __len__(self):
+        return len(self.keys())
+
+
+def build_precondition_index(data):
+    ids_by_ambiente = {ambiente: {} for ambiente in AMBIENTES}
+    for issue in data['issues']:
+        for ambiente in AMBIENTES:
+            # Se conserva la primera aparición, igual que la búsqueda lineal original
+            ids_by_ambiente[ambiente].setdefault(issue['key'], issue.get(f'id{ambiente}'))
+    return IdIndex(ids_by_ambiente)
+
+
+def build_test_set_index(data):
+    # key del test -> lista de ids de sus test sets
+    ids_by_ambiente = {ambiente: {} for ambiente in AMBIENTES}
+    for issue in data['issues']:
+        for ambiente in AMBIENTES:
+            ids_by_ambiente[ambiente].setdefault(
+                issue['key'], [ts.get(f'id{ambiente}') for ts in issue.get('associated_test_sets', [])])
+    return IdIndex(ids_by_ambiente)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_index(file_path, builder):
+    with _indexes_lock:
+        index = _indexes.get(file_path)
+        if index is None:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                index = builder(json.load(f))
+            _indexes[file_path] = index
+    return index
+
+
+def get_precondition_index(file_path=PRECONDITIONS_FILE):
+    return _get_index(file_path, build_precondition_index)
+
+
+def get_test_set_index(file_path=TEST_SETS_FILE):
+    return _get_index(file_path, build_test_set_index)
+
+
+def resolve_precondition_ids(precondition_keys, ambiente):
+    return get_precondition_index().resolve(precondition_keys, ambiente)
+
+
+def resolve_test_set_ids(test_keys, ambiente):
+    return get_test_set_index().resolve(test_keys, ambiente)
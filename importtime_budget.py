@@ -0,0 +1,65 @@
+# importtime_budget.py
+#
+# Verifica que importar los módulos sea barato y sin efectos secundarios: mide cada import
+# con `python -X importtime` en un proceso limpio (sin argumentos de línea de comandos)
+# y falla si supera su presupuesto, si el import falla o si imprime algo en stdout.
+# Uso: python importtime_budget.py   (código de salida 1 si algún módulo no cumple)
+
+import os
+import subprocess
+import sys
+
+# Presupuesto de import acumulado por módulo, en milisegundos
+BUDGETS_MS = {
+    'config': 10,
+    'id_lookup': 60,
+    'progress_ledger': 120,
+    'CacheIssue': 150,
+    'http_cache': 550,
+    'retry_util': 600,
+    'xray_service': 700,
+    'jira_service': 700,
+    'xrayServer_service': 700,
+    'test_processor': 800,
+    'bulk_import': 800,
+    'subirinfo': 900,
+}
+
+
+def measure(module):
+    # Devuelve (ms acumulados del módulo, stdout, código de salida)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # Formato: "import time:  self [us] | cumulative | imported package"
+        if not line.startswith('import time:'):
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative_us = int(parts[1])
+    return (cumulative_us / 1000 if cumulative_us is not None else None), result.stdout, result.returncode
+
+
+def main():
+    failures = 0
+    for module, budget_ms in BUDGETS_MS.items():
+        elapsed_ms, stdout, returncode = measure(module)
+        if returncode != 0 or elapsed_ms is None:
+            status = f"ERROR (exit {returncode})"
+            failures += 1
+        elif stdout.strip():
+            status = "ERROR (imprime al importar)"
+            failures += 1
+        elif elapsed_ms > budget_ms:
+            status = "EXCEDIDO"
+            failures += 1
+        else:
+            status = "OK"
+        elapsed = f"{elapsed_ms:.1f}" if elapsed_ms is not None else "-"
+        print(f"{module:<20} {elapsed:>8} ms / {budget_ms:>4} ms  {status}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# incremental_sync.py
+#
+# Sincronización incremental (--incremental): en lugar de volver a consultar en cloud todas
+# las keys no listas, solo se revisan las que cambiaron en server o en cloud desde la última
+# sincronización de su proyecto. Las marcas de agua se guardan en el ledger de progreso:
+#   por proyecto: inicio de la última sincronización completa (filtro JQL updated >=)
+#   por key: lastModified de cloud visto en la última consulta
+# Las keys seleccionadas quedan pendientes en el ledger hasta que estén listas: las marcas de
+# agua avanzan aunque la ejecución procese solo una parte y las demás se vuelven a seleccionar.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from jira_service import iter_issues_jql_server, getMyselfServer, getMyselfCloud
+from xray_service import getTestsModifiedSince
+
+# Margen restado a la marca de agua: JQL trabaja en minutos y los relojes pueden diferir
+WATERMARK_SKEW_SECONDS = int(os.getenv('WATERMARK_SKEW_SECONDS', 600))
+
+# Jira interpreta las fechas del JQL en la zona horaria del perfil del usuario que consulta.
+# Vacías: se toma el timeZone de /myself de cada instancia (si falla, la hora local)
+WATERMARK_TIMEZONE_SERVER = os.getenv('WATERMARK_TIMEZONE_SERVER')
+WATERMARK_TIMEZONE_CLOUD = os.getenv('WATERMARK_TIMEZONE_CLOUD')
+
+
+def project_of(key):
+    return key.rsplit('-', 1)[0]
+
+
+def jql_timezone(configured, get_myself):
+    name = configured
+    try:
+        if not name:
+            name = get_myself().get('timeZone')
+        return ZoneInfo(name) if name else None
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        print(f"Zona horaria de Jira no válida ({name}): {e}; se usa la hora local")
+    except Exception as e:
+        print(f"No se pudo obtener la zona horaria de Jira: {e}; se usa la hora local")
+    return None
+
+
+def updated_since_jql(project, since, timezone=None):
+    # timezone=None: hora local del proceso
+    since = datetime.fromtimestamp(since - WATERMARK_SKEW_SECONDS, timezone).strftime('%Y/%m/%d %H:%M')
+    return f'project = "{project}" AND updated >= "{since}"'
+
+
+def changed_server_keys(project, since, timezone=None):
+    return {issue['key'] for issue in iter_issues_jql_server(updated_since_jql(project, since, timezone), ['updated'])}
+
+
+def changed_cloud_keys(project, since, ledger, timezone=None):
+    modified = getTestsModifiedSince(updated_since_jql(project, since, timezone))
+    # Con la resolución en minutos del JQL se descartan las keys cuyo lastModified no cambió
+    seen = ledger.get_key_watermarks(modified)
+    return {key for key, last_modified in modified.items() if seen.get(key) != last_modified}
+
+
+def select_changed_keys(keys, ledger, max_workers=4):
+    # Devuelve las keys a consultar: las nunca vistas, las de proyectos sin marca de agua,
+    # las que cambiaron en server o cloud desde la marca de agua de su proyecto y las
+    # seleccionadas en ejecuciones anteriores que aún no están listas
+    keys_by_project = {}
+    for key in keys:
+        keys_by_project.setdefault(project_of(key), set()).add(key)
+
+    seen = ledger.get_key_watermarks(keys)
+    selected = {key for key in keys if key not in seen} | ledger.get_pending_keys(keys)
+
+    watermarks = {project: ledger.get_project_watermark(project) for project in keys_by_project}
+    delta_projects = [project for project, since in watermarks.items() if since is not None]
+    for project, since in watermarks.items():
+        if since is None:
+            selected |= keys_by_project[project]
+
+    server_timezone = cloud_timezone = None
+    if delta_projects:
+        server_timezone = jql_timezone(WATERMARK_TIMEZONE_SERVER, getMyselfServer)
+        cloud_timezone = jql_timezone(WATERMARK_TIMEZONE_CLOUD, lambda: getMyselfCloud(None))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        server = {project: executor.submit(changed_server_keys, project, watermarks[project], server_timezone) for project in delta_projects}
+        cloud = {project: executor.submit(changed_cloud_keys, project, watermarks[project], ledger, cloud_timezone) for project in delta_projects}
+        for project in delta_projects:
+            changed = server[project].result() | cloud[project].result()
+            selected |= keys_by_project[project] & changed
+            print(f"Proyecto {project}: {len(changed)} tests cambiados desde la última sincronización")
+
+    ledger.add_pending_keys(selected)
+    return selected, list(keys_by_project)
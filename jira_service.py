@@ -1,8 +1,9 @@
-import requests
 import os
 from dotenv import load_dotenv
 from retry_util import retry_request, make_request
 from requests.auth import HTTPBasicAuth
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv(override=True)
 
@@ -15,13 +16,26 @@ API_TOKEN_SERVER = os.getenv('API_TOKEN_SERVER')
 # Variables globales para reintentos
 RETRIES = 10
 DELAY = 6
-# Añadiendo mensaje de depuración para verificar las variables de entorno
-print(f"JIRA_BASE_URL: {JIRA_BASE_URL}")
-print(f"API_TOKEN: {API_TOKEN[:4]}...") 
-print(f"JIRA_BASE_URL_SERVER: {JIRA_BASE_URL_SERVER}")
-print(f"API_TOKEN_SERVER: {API_TOKEN_SERVER}")
-print(f"USERNAMEJIRA: {USERNAMEJIRA}")
-# Muestra solo los primeros caracteres del token por seguridad
+
+# Campo del Test Plan en Jira Server; se devuelve renombrado como 'testplan'
+TESTPLAN_CUSTOMFIELD = os.getenv('JIRA_TESTPLAN_CUSTOMFIELD', 'customfield_10135')
+
+# Páginas de búsqueda JQL en vuelo simultáneamente (Jira Server)
+MAX_PAGES_IN_FLIGHT = int(os.getenv('JIRA_MAX_PAGES_IN_FLIGHT', 8))
+
+def mask(value, visible=4):
+    # Muestra solo los primeros caracteres del token por seguridad
+    if not value:
+        return value
+    return f"{value[:visible]}..."
+
+def log_settings():
+    # Mensaje de depuración para verificar las variables de entorno (no se ejecuta al importar)
+    print(f"JIRA_BASE_URL: {JIRA_BASE_URL}")
+    print(f"API_TOKEN: {mask(API_TOKEN)}")
+    print(f"JIRA_BASE_URL_SERVER: {JIRA_BASE_URL_SERVER}")
+    print(f"API_TOKEN_SERVER: {mask(API_TOKEN_SERVER)}")
+    print(f"USERNAMEJIRA: {USERNAMEJIRA}")
 
 def get_issue(issue_id_or_key):
     url = f"{JIRA_BASE_URL}/rest/api/3/issue/{issue_id_or_key}?fields=key,summary"
@@ -31,7 +45,7 @@ def get_issue(issue_id_or_key):
     auth = HTTPBasicAuth(USERNAMEJIRA, API_TOKEN)
     
     #print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, auth=auth, retries=RETRIES, delay=DELAY)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, auth=auth, retries=RETRIES, delay=DELAY)
     return response.json()
 
 def get_userCloud(userEmail):
@@ -43,7 +57,7 @@ def get_userCloud(userEmail):
     auth = HTTPBasicAuth(USERNAMEJIRA, API_TOKEN)
     
     #print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, auth=auth, retries=RETRIES, delay=DELAY)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, auth=auth, retries=RETRIES, delay=DELAY)
     return response.json()
 
 
@@ -67,7 +81,7 @@ def getIssueJQL(query):
 
         print(f"Fetching URL: {url}")
         print(f"CONSULTA JQL: {body_data}")
-        response = retry_request(make_request, url, method='POST', headers=headers, json=body_data, auth=auth, retries=RETRIES, delay=DELAY)
+        response = retry_request(make_request, None, url, method='POST', headers=headers, json=body_data, auth=auth, retries=RETRIES, delay=DELAY)
         response_json = response.json()
 
         # Añadir los problemas obtenidos a la lista total de problemas
@@ -98,50 +112,78 @@ def getMyselfCloud(issue_id_or_key):
     auth = HTTPBasicAuth(USERNAMEJIRA, API_TOKEN)
     
     #print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, auth=auth, retries=1, delay=1)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, auth=auth, retries=1, delay=1, cache=False)
     return response.json()
 
 # Jira SERVER con autenticación Bearer y paginación customfield_10135
 
-def getIssueJQLServer(query, fields, only=None):
+def fetch_issue_page_server(query, fields, start_at, max_results, customfield=None):
     url = f"{JIRA_BASE_URL_SERVER}/rest/api/2/search"
     headers = {
         'Accept': 'application/json',
         'Authorization': f'Bearer {API_TOKEN_SERVER}'
     }
-    max_results = 100
-    start_at = 0
-    total_issues = []
-
-    # Usar el campo customfield de config.execution_config
-    customfield = config.execution_config['testplan_customfield']
+    customfield = customfield or TESTPLAN_CUSTOMFIELD
 
-    while True:
-        body_data = {
-            "fields": fields,  # Pasar directamente la lista de campos
-            "jql": query,
-            "maxResults": max_results,
-            "startAt": start_at
-        }
+    body_data = {
+        "fields": fields,  # Pasar directamente la lista de campos
+        "jql": query,
+        "maxResults": max_results,
+        "startAt": start_at
+    }
 
-        print(f"Fetching URL: {url} (startAt={start_at})")
-        response = retry_request(make_request, url, method='POST', headers=headers, json=body_data, retries=RETRIES, delay=DELAY)
-        
-        data = response.json()
-        for issue in data['issues']:
-            # Renombrar el campo customfield a 'testplan'
-            issue['fields']['testplan'] = issue['fields'].pop(customfield, None)
-        total_issues.extend(data['issues'])
+    print(f"Fetching URL: {url} (startAt={start_at})")
+    response = retry_request(make_request, None, url, method='POST', headers=headers, json=body_data, retries=RETRIES, delay=DELAY)
 
-        # Check if the limit specified by 'only' is reached
-        if only is not None and len(total_issues) >= only:
-            return total_issues[:only]
+    data = response.json()
+    for issue in data['issues']:
+        # Renombrar el campo customfield a 'testplan'
+        issue['fields']['testplan'] = issue['fields'].pop(customfield, None)
+    return data
 
-        if start_at + max_results >= data['total']:
-            break
-        start_at += max_results
+def iter_issues_jql_server(query, fields, only=None, max_in_flight=None, customfield=None):
+    # Página 1 primero (da data['total']); el resto de offsets startAt se piden en paralelo
+    # con un máximo de max_in_flight páginas en vuelo y se entregan en orden
+    max_results = 100
+    if max_in_flight is None:
+        max_in_flight = MAX_PAGES_IN_FLIGHT
+
+    first_page_size = min(max_results, only) if only is not None else max_results
+    data = fetch_issue_page_server(query, fields, 0, first_page_size, customfield)
+    limit = data['total'] if only is None else min(data['total'], only)
+    yielded = 0
+    for issue in data['issues'][:limit]:
+        yield issue
+        yielded += 1
+
+    # Offsets restantes; la última página pide solo lo necesario para respetar 'only'
+    offsets = iter(range(first_page_size, limit, max_results))
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    pending = deque()
+    try:
+        def submit_next():
+            start_at = next(offsets, None)
+            if start_at is not None:
+                pending.append(executor.submit(fetch_issue_page_server, query, fields, start_at, min(max_results, limit - start_at), customfield))
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        while pending:
+            page = pending.popleft().result()
+            submit_next()
+            for issue in page['issues']:
+                if yielded >= limit:
+                    return
+                yield issue
+                yielded += 1
+    finally:
+        # Si el consumidor deja de iterar, no se piden más páginas
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def getIssueJQLServer(query, fields, only=None, customfield=None):
+    return list(iter_issues_jql_server(query, fields, only=only, customfield=customfield))
 
-    return total_issues
 def getMyselfServer():
     url = f"{JIRA_BASE_URL_SERVER}/rest/api/2/myself"
     headers = {
@@ -150,7 +192,7 @@ def getMyselfServer():
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=1, delay=1)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=1, delay=1, cache=False)
     data = response.json()
 
     return data
@@ -163,7 +205,7 @@ def getUserServer(user):
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=1, delay=1)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=1, delay=1)
     data = response.json()
 
     return data
@@ -175,7 +217,7 @@ def get_specific_issue(issue_key, custom_field):
         'Authorization': f'Bearer {API_TOKEN_SERVER}'
     }
 
-    response = requests.get(url, headers=headers)
+    response = make_request(url, headers=headers)
     if response.status_code == 200:
         issue_details = response.json()
         custom_field_value = issue_details.get('fields', {}).get(custom_field, 'No custom field found')
@@ -0,0 +1,125 @@
+# pipeline.py
+#
+# Pipeline productor/consumidor por etapas: cada etapa tiene una cola acotada y sus propios
+# hilos, así las etapas de tests distintos se solapan en lugar de esperar cada una la ida y
+# vuelta de la anterior. Un elemento está en una sola etapa a la vez y pasa por ellas en
+# orden, por lo que las etapas de un mismo test nunca se adelantan entre sí.
+# Las colas acotadas frenan al productor cuando una etapa se atrasa.
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger()
+
+STOP = object()
+
+
+class Stage:
+    def __init__(self, name, func, workers, queue_size):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def put(self, item):
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def get_stats(self):
+        return {'depth': self.queue.qsize(), 'max_depth': self.max_depth, 'busy': self.busy,
+                'workers': self.workers, 'processed': self.processed, 'errors': self.errors}
+
+
+class Pipeline:
+    # stages: lista de (nombre, función, hilos); la función recibe el elemento y puede
+    # devolver False para que no siga a las etapas siguientes.
+    # on_thread_start/on_thread_end: se llaman en cada hilo de trabajo (p. ej. asignar un cliente)
+    def __init__(self, stages, queue_size=50, on_thread_start=None, on_thread_end=None, report_interval=None):
+        self.stages = [Stage(name, func, workers, queue_size) for name, func, workers in stages]
+        self.on_thread_start = on_thread_start
+        self.on_thread_end = on_thread_end
+        self.report_interval = report_interval
+        self.completed = 0
+        self.completed_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reporter = None
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for number in range(stage.workers):
+                thread = threading.Thread(target=self.worker, args=(stage, next_stage),
+                                          name=f"{stage.name}-{number}", daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+        if self.report_interval:
+            self.reporter = threading.Thread(target=self.report_loop, name="pipeline-report", daemon=True)
+            self.reporter.start()
+        return self
+
+    def worker(self, stage, next_stage):
+        if self.on_thread_start:
+            self.on_thread_start()
+        try:
+            while True:
+                item = stage.queue.get()
+                if item is STOP:
+                    return
+                with stage.lock:
+                    stage.busy += 1
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logger.error(f"Error en la etapa {stage.name}: {e}")
+                    result = False
+                    with stage.lock:
+                        stage.errors += 1
+                with stage.lock:
+                    stage.busy -= 1
+                    stage.processed += 1
+                if result is not False and next_stage is not None:
+                    next_stage.put(item)
+                else:
+                    with self.completed_lock:
+                        self.completed += 1
+        finally:
+            if self.on_thread_end:
+                self.on_thread_end()
+
+    def submit(self, item):
+        # Bloquea mientras la cola de la primera etapa esté llena
+        self.stages[0].put(item)
+
+    def close(self):
+        # Se cierran las etapas en orden: cuando los hilos de una terminan, todo lo que
+        # tenían ya pasó a la cola de la siguiente
+        for stage in self.stages:
+            for _ in range(stage.workers):
+                stage.queue.put(STOP)
+            for thread in stage.threads:
+                thread.join()
+        self.stopped.set()
+        if self.reporter is not None:
+            self.reporter.join()
+        self.log_stats()
+
+    def get_stats(self):
+        return {stage.name: stage.get_stats() for stage in self.stages}
+
+    def log_stats(self):
+        for name, stats in self.get_stats().items():
+            logger.info(f"Etapa {name}: {stats}")
+
+    def report_loop(self):
+        while not self.stopped.wait(self.report_interval):
+            depths = ', '.join(f"{stage.name}={stage.queue.qsize()}" for stage in self.stages)
+            logger.info(f"Colas del pipeline: {depths} (completados: {self.completed})")
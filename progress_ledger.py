@@ -0,0 +1,339 @@
+# progress_ledger.py
+#
+# Estado de la migración en SQLite (logs/progress.db) en lugar de los logs/*.json
+# que se releían y reescribían completos en cada append.
+# Cada test pasa por pending -> updated -> ready, o error (ready es terminal).
+# Las consultas de pertenencia se resuelven con los sets en memoria; cada transición
+# es una sola sentencia atómica. export_json genera los JSON con el formato anterior.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LOG_DIR = 'logs'
+LEDGER_FILE = os.path.join(LOG_DIR, 'progress.db')
+
+PENDING = 'pending'
+UPDATED = 'updated'
+READY = 'ready'
+ERROR = 'error'
+
+# Archivos JSON con el formato histórico
+TEST_CASE_READY_FILE = 'TestCaseReady.json'
+TEST_CASES_UPDATED_FILE = 'TestCasesUpdated.json'
+ERROR_TEST_CASE_FILE = 'ErrorTestCase.json'
+PRECONDITION_READY_FILE = 'preconditionReadyUpdated.json'
+PRECONDITION_ERROR_FILE = 'preconditionError.json'
+
+
+class ProgressLedger:
+    def __init__(self, path=LEDGER_FILE, log_dir=LOG_DIR):
+        self.path = path
+        self.log_dir = log_dir
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tests (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                changed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS preconditions (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                error TEXT,
+                changed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS errors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS key_watermarks (
+                key TEXT PRIMARY KEY,
+                cloud_modified TEXT,
+                synced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS project_watermarks (
+                project TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pending_keys (
+                key TEXT PRIMARY KEY,
+                selected_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+
+        # Espejo en memoria para consultas de pertenencia sin I/O
+        self.test_state = {}
+        self.tests_updated = set()
+        self.precondition_state = {}
+        for key, state, updated in self.conn.execute('SELECT key, state, updated FROM tests'):
+            self.test_state[key] = state
+            if updated:
+                self.tests_updated.add(key)
+        for key, state in self.conn.execute('SELECT key, state FROM preconditions'):
+            self.precondition_state[key] = state
+
+        if self._get_meta('imported_json') is None:
+            self.import_json(log_dir)
+
+    def _get_meta(self, name):
+        row = self.conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self.conn.execute('INSERT INTO meta (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+                          (name, value))
+
+    # Tests
+
+    def get_test_state(self, key):
+        return self.test_state.get(key, PENDING)
+
+    def is_test_ready(self, key):
+        return self.test_state.get(key) == READY
+
+    def is_test_updated(self, key):
+        return key in self.tests_updated
+
+    def tests_in_state(self, state, since=None):
+        if since is None:
+            return [key for key, current in self.test_state.items() if current == state]
+        with self.lock:
+            rows = self.conn.execute('SELECT key FROM tests WHERE state = ? AND changed_at >= ?', (state, since)).fetchall()
+        return [row[0] for row in rows]
+
+    def _set_test(self, key, state, updated=None, error=None):
+        now = time.time()
+        with self.lock:
+            if self.test_state.get(key) == READY and state != READY:
+                # ready es terminal: solo se conserva el error en el historial
+                return False
+            is_updated = (key in self.tests_updated) if updated is None else updated
+            self.conn.execute('''
+                INSERT INTO tests (key, state, updated, error, changed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated = excluded.updated,
+                    error = excluded.error, changed_at = excluded.changed_at
+            ''', (key, state, int(is_updated), error, now))
+            if state == READY:
+                # Ya no hace falta volver a seleccionarla en la sincronización incremental
+                self.conn.execute('DELETE FROM pending_keys WHERE key = ?', (key,))
+            self.test_state[key] = state
+            if is_updated:
+                self.tests_updated.add(key)
+            else:
+                self.tests_updated.discard(key)
+            return True
+
+    def mark_test_pending(self, key):
+        return self._set_test(key, PENDING)
+
+    def mark_test_updated(self, key):
+        return self._set_test(key, UPDATED, updated=True)
+
+    def mark_test_ready(self, key):
+        return self._set_test(key, READY)
+
+    def mark_test_error(self, key, error_message):
+        self.record_error('test', key, error_message)
+        return self._set_test(key, ERROR, error=error_message)
+
+    def set_tests_updated(self, scope_keys, updated_keys):
+        # Para las keys del alcance, el flag 'updated' pasa a reflejar exactamente updated_keys
+        updated_keys = set(updated_keys)
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                for key in scope_keys:
+                    is_updated = key in updated_keys
+                    state = self.test_state.get(key, PENDING)
+                    if state == PENDING and is_updated:
+                        state = UPDATED
+                    self.conn.execute('''
+                        INSERT INTO tests (key, state, updated, changed_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE SET updated = excluded.updated, state = excluded.state
+                    ''', (key, state, int(is_updated), now))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            for key in scope_keys:
+                if key in updated_keys:
+                    self.tests_updated.add(key)
+                    self.test_state.setdefault(key, UPDATED)
+                else:
+                    self.tests_updated.discard(key)
+
+    # Precondiciones
+
+    def is_precondition_ready(self, key):
+        return self.precondition_state.get(key) == READY
+
+    def preconditions_in_state(self, state):
+        return [key for key, current in self.precondition_state.items() if current == state]
+
+    def _set_precondition(self, key, state, error=None):
+        with self.lock:
+            if self.precondition_state.get(key) == READY and state != READY:
+                return False
+            self.conn.execute('''
+                INSERT INTO preconditions (key, state, error, changed_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET state = excluded.state, error = excluded.error, changed_at = excluded.changed_at
+            ''', (key, state, error, time.time()))
+            self.precondition_state[key] = state
+            return True
+
+    def mark_precondition_ready(self, key):
+        return self._set_precondition(key, READY)
+
+    def mark_precondition_error(self, key, error_message):
+        self.record_error('precondition', key, error_message)
+        return self._set_precondition(key, ERROR, error=error_message)
+
+    # Marcas de agua de la sincronización incremental
+
+    def get_key_watermarks(self, keys):
+        # {key: lastModified de cloud en la última sincronización} para las keys ya sincronizadas
+        keys = list(keys)
+        watermarks = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f'SELECT key, cloud_modified FROM key_watermarks WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+                watermarks.update(rows)
+        return watermarks
+
+    def set_key_watermarks(self, cloud_modified_by_key):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                self.conn.executemany('''
+                    INSERT INTO key_watermarks (key, cloud_modified, synced_at) VALUES (?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET cloud_modified = excluded.cloud_modified, synced_at = excluded.synced_at
+                ''', [(key, modified, now) for key, modified in cloud_modified_by_key.items()])
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def get_project_watermark(self, project):
+        with self.lock:
+            row = self.conn.execute('SELECT synced_at FROM project_watermarks WHERE project = ?', (project,)).fetchone()
+        return row[0] if row else None
+
+    def set_project_watermarks(self, projects, synced_at):
+        with self.lock:
+            self.conn.executemany('''
+                INSERT INTO project_watermarks (project, synced_at) VALUES (?, ?)
+                ON CONFLICT(project) DO UPDATE SET synced_at = excluded.synced_at
+            ''', [(project, synced_at) for project in projects])
+
+    def get_pending_keys(self, keys):
+        # Keys seleccionadas por una sincronización incremental anterior que aún no están listas
+        keys = list(keys)
+        pending = set()
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(f'SELECT key FROM pending_keys WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+                pending.update(row[0] for row in rows)
+        return pending
+
+    def add_pending_keys(self, keys):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('''
+                INSERT INTO pending_keys (key, selected_at) VALUES (?, ?)
+                ON CONFLICT(key) DO NOTHING
+            ''', [(key, now) for key in keys])
+
+    # Historial de errores (append-only)
+
+    def record_error(self, kind, key, error_message):
+        with self.lock:
+            self.conn.execute('INSERT INTO errors (kind, key, error, created_at) VALUES (?, ?, ?, ?)',
+                              (kind, str(key), error_message, time.time()))
+
+    # Importación / exportación de los JSON históricos
+
+    def import_json(self, log_dir=LOG_DIR):
+        def read(file_name):
+            file_path = os.path.join(log_dir, file_name)
+            if not os.path.exists(file_path):
+                return []
+            with open(file_path, 'r', encoding='utf-8') as f:
+                try:
+                    return json.load(f)
+                except json.JSONDecodeError:
+                    return []
+
+        updated = read(TEST_CASES_UPDATED_FILE)
+        self.set_tests_updated(updated, updated)
+        for entry in read(ERROR_TEST_CASE_FILE):
+            self._set_test(entry['key'], ERROR, error=entry.get('error'))
+        for key in read(TEST_CASE_READY_FILE):
+            self._set_test(key, READY)
+        for entry in read(PRECONDITION_ERROR_FILE):
+            self._set_precondition(entry['key'], ERROR, error=entry.get('error'))
+        for key in read(PRECONDITION_READY_FILE):
+            self._set_precondition(key, READY)
+        with self.lock:
+            self._set_meta('imported_json', str(time.time()))
+
+    def export_json(self, log_dir=None):
+        log_dir = log_dir or self.log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        with self.lock:
+            test_errors = self.conn.execute('SELECT key, error FROM tests WHERE state = ? ORDER BY changed_at', (ERROR,)).fetchall()
+            precondition_errors = self.conn.execute('SELECT key, error FROM preconditions WHERE state = ? ORDER BY changed_at', (ERROR,)).fetchall()
+            ready = [row[0] for row in self.conn.execute('SELECT key FROM tests WHERE state = ? ORDER BY changed_at', (READY,))]
+            updated = [row[0] for row in self.conn.execute('SELECT key FROM tests WHERE updated = 1 ORDER BY changed_at')]
+            preconditions_ready = [row[0] for row in self.conn.execute('SELECT key FROM preconditions WHERE state = ? ORDER BY changed_at', (READY,))]
+
+        exports = {
+            TEST_CASE_READY_FILE: ready,
+            TEST_CASES_UPDATED_FILE: updated,
+            ERROR_TEST_CASE_FILE: [{'key': key, 'error': error} for key, error in test_errors],
+            PRECONDITION_READY_FILE: preconditions_ready,
+            PRECONDITION_ERROR_FILE: [{'key': key, 'error': error} for key, error in precondition_errors]
+        }
+        for file_name, content in exports.items():
+            # Escritura atómica: archivo temporal + os.replace
+            file_path = os.path.join(log_dir, file_name)
+            tmp_path = f"{file_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, indent=4)
+            os.replace(tmp_path, file_path)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = ProgressLedger()
+    return _ledger
@@ -0,0 +1,116 @@
+# rate_limiter.py
+
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+# Cuotas por defecto (peticiones por segundo y ráfaga máxima)
+XRAY_RATE_PER_SECOND = float(os.getenv('XRAY_RATE_PER_SECOND', 5))
+XRAY_BURST = float(os.getenv('XRAY_BURST', 10))
+JIRA_RATE_PER_SECOND = float(os.getenv('JIRA_RATE_PER_SECOND', 10))
+JIRA_BURST = float(os.getenv('JIRA_BURST', 20))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Pausa impuesta por un 429 (Retry-After)
+        self.acquired = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        # Toma los tokens si hay disponibles y devuelve 0; si no, devuelve los segundos a esperar
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                self.acquired += 1
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        # Bloquea el hilo hasta disponer de los tokens (o hasta timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.reserve(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        while True:
+            wait = self.reserve(tokens)
+            if wait == 0:
+                return True
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds):
+        # Respuesta 429: vaciar el bucket y bloquear a todos los hilos durante 'seconds'
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+            self.updated = now
+            self.throttled += 1
+
+    def available(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return 0
+            return self.tokens
+
+    def backoff_remaining(self):
+        with self.lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(name, rate, burst):
+    with limiters_lock:
+        limiter = limiters.get(name)
+        if limiter is None:
+            limiter = TokenBucket(rate, burst)
+            limiters[name] = limiter
+    return limiter
+
+
+def get_client_limiter(client_id):
+    return get_limiter(f"xray:{client_id}", XRAY_RATE_PER_SECOND, XRAY_BURST)
+
+
+def get_host_limiter(url):
+    return get_limiter(f"host:{urlsplit(url).netloc}", JIRA_RATE_PER_SECOND, JIRA_BURST)
+
+
+def get_retry_after(response, default):
+    # Segundos indicados por el servidor en Retry-After, o el valor por defecto
+    if response is None:
+        return default
+    value = response.headers.get('Retry-After') if response.headers else None
+    try:
+        return max(float(value), 0) if value is not None else default
+    except ValueError:
+        return default
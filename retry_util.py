@@ -1,17 +1,58 @@
 # retry_util.py
 
 import time
+import atexit
 import requests
 import logging
 import threading
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rate_limiter import get_client_limiter, get_host_limiter, get_retry_after
+from http_cache import HTTP_CACHE_ENABLED, get_http_cache
 
 # Configuración del logger
 logger = logging.getLogger('retry_util')
 thread_local = threading.local()
 
-# Variable global para manejar los retrasos por cliente
-client_delay_info = {}
-client_delay_lock = threading.Lock()
+# Pool de sesiones HTTP keep-alive por (base URL, client id)
+POOL_SIZE = 25  # Conexiones por sesión; se ajusta a NUM_THREADS con configure_session_pool
+sessions = {}
+sessions_lock = threading.Lock()
+
+def configure_session_pool(pool_size):
+    global POOL_SIZE
+    with sessions_lock:
+        POOL_SIZE = pool_size
+    # Las sesiones existentes se recrean con el nuevo tamaño en el siguiente uso
+    close_sessions()
+
+def get_base_url(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def get_session(url, client_id=None):
+    key = (get_base_url(url), client_id)
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # Solo se reintentan fallos al abrir la conexión (la petición no llegó a enviarse),
+            # así reutilizar una conexión caída es seguro incluso para POST. Los 429/5xx los maneja retry_request.
+            retries = Retry(total=2, connect=2, read=0, status=0, other=0, allowed_methods=None, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retries)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            sessions[key] = session
+    return session
+
+def close_sessions():
+    with sessions_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
+
+atexit.register(close_sessions)
 
 def set_thread_local_account(account):
     thread_local.account = account
@@ -19,30 +60,32 @@ def set_thread_local_account(account):
 def get_thread_local_account():
     return getattr(thread_local, 'account', None)
 
-def retry_request(func, client, *args, retries=3, delay=6, **kwargs):
-    global client_delay_info
+def get_request_limiter(client, args, kwargs):
+    # Cliente Xray: bucket por client id; sin cliente: bucket por host de la URL
+    if isinstance(client, dict):
+        return get_client_limiter(client['id'])
+    url = args[0] if args else kwargs.get('url')
+    return get_host_limiter(url)
 
-    with client_delay_lock:
-        if client['id'] not in client_delay_info:
-            client_delay_info[client['id']] = {'delay': delay, 'last_attempt': 0}
+def retry_request(func, client, *args, retries=3, delay=6, **kwargs):
+    limiter = get_request_limiter(client, args, kwargs)
+    client_id = client['id'] if isinstance(client, dict) else None
 
     for attempt in range(retries):
-        with client_delay_lock:
-            client_delay_info[client['id']]['last_attempt'] = time.time()
-        
+        # Esperar turno en el token bucket antes de enviar
+        limiter.acquire()
+
         try:
             response = func(*args, **kwargs)
             response.raise_for_status()
             return response
         except requests.RequestException as e:
             if e.response is not None and e.response.status_code == 429:
-                with client_delay_lock:
-                    current_delay = client_delay_info[client['id']]['delay']
-                    last_attempt = client_delay_info[client['id']]['last_attempt']
-                    logger.warning(f"Attempt {attempt + 1} failed with error: {e}. Client ID: {client['id']} Too Many Requests. Retrying in {current_delay} seconds...")
-                    time_to_wait = current_delay - (time.time() - last_attempt)
-                    if time_to_wait > 0:
-                        time.sleep(time_to_wait)
+                time_to_wait = get_retry_after(e.response, delay)
+                logger.warning(f"Attempt {attempt + 1} failed with error: {e}. Client ID: {client_id} Too Many Requests. Retrying in {time_to_wait} seconds...")
+                # Pausa compartida por todos los hilos que usan el mismo bucket
+                limiter.penalize(time_to_wait)
+                continue
             elif e.response is not None and e.response.status_code == 401:
                 logger.error(f"Attempt {attempt + 1} failed with error: {e}. Unauthorized. Retrying...")
                 return func(*args, **kwargs)  # Retry without delay for authentication errors
@@ -56,17 +99,21 @@ def retry_request(func, client, *args, retries=3, delay=6, **kwargs):
                         logger.error(f"Error response JSON: {e.response.json()}")
                     except ValueError:
                         logger.error(f"Error response text: {e.response.text}")
-            time.sleep(client_delay_info[client['id']]['delay'])
+            time.sleep(delay)
     raise Exception(f"All {retries} attempts failed or encountered a non-retryable error.")
 
-def make_request(url, method='GET', headers=None, json=None, params=None, files=None, auth=None):
+def make_request(url, method='GET', headers=None, json=None, params=None, files=None, auth=None, client_id=None, cache=True):
+    session = get_session(url, client_id)
     if method.upper() == 'GET':
-        return requests.get(url, headers=headers, params=params, auth=auth)
+        if cache and HTTP_CACHE_ENABLED:
+            # Respuesta desde la caché persistente o revalidada con una petición condicional
+            return get_http_cache().get(session, url, headers=headers, params=params, auth=auth)
+        return session.get(url, headers=headers, params=params, auth=auth)
     elif method.upper() == 'POST':
-        return requests.post(url, headers=headers, json=json, params=params, files=files, auth=auth)
+        return session.post(url, headers=headers, json=json, params=params, files=files, auth=auth)
     elif method.upper() == 'PUT':
-        return requests.put(url, headers=headers, json=json, params=params, auth=auth)
+        return session.put(url, headers=headers, json=json, params=params, auth=auth)
     elif method.upper() == 'DELETE':
-        return requests.delete(url, headers=headers, params=params, auth=auth)
+        return session.delete(url, headers=headers, params=params, auth=auth)
     else:
         raise ValueError(f"Unsupported HTTP method: {method}")
@@ -0,0 +1,47 @@
+# single_flight.py
+#
+# Registro "single-flight" por key: el primer hilo que pide una key ejecuta la operación,
+# los que llegan mientras está en curso esperan su resultado y los posteriores la encuentran
+# en el conjunto de keys ya hechas sin repetirla. Si la operación falla, los que esperaban
+# reciben la misma excepción y la key queda libre para reintentarse.
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self, done=()):
+        self.done = set(done)
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, func):
+        # Devuelve True si este llamado ejecutó func, False si ya estaba hecha (o la hizo otro hilo)
+        with self.lock:
+            if key in self.done:
+                return False
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+
+        if not owner:
+            future.result()
+            return False
+
+        try:
+            func()
+        except Exception as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.done.add(key)
+            del self.inflight[key]
+        future.set_result(True)
+        return True
+
+    def is_done(self, key):
+        return key in self.done
@@ -1,20 +1,25 @@
-import json
 import os
-import threading
+import sys
 import time
 import logging
 import config
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from dotenv import load_dotenv
 from xray_service import (
-    getStatusXrayCloud,
     set_thread_local_account,
     get_thread_local_account,
     get_next_client,
+    release_client,
+    get_client_utilization,
     getTestCasesUpdated
 )
-from CacheIssue import CacheIssue
-from test_processor import process_testcases
+from cache_registry import CacheRegistry
+from progress_ledger import get_ledger, ERROR, READY
+from test_processor import process_testcases, new_task, TEST_STAGES
+from pipeline import Pipeline
+from bulk_association import associate_in_bulk
+from bulk_import import bulk_import_tests
+from incremental_sync import select_changed_keys
+from content_hash import cloud_state
 import retry_util  # Importa el módulo para threading.local
 from accessValidator import accessValidator
 
@@ -22,19 +27,6 @@ from accessValidator import accessValidator
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler()])
 logger = logging.getLogger()
 
-# Validar accesos
-res = accessValidator()
-if res == 0:
-    logger.info("...Accesos Validados...")
-    logger.info("****************************************************")
-else:
-    logger.error(f"...Accesos NO Validados [{res}]...")
-    logger.info("****************************************************")
-    sys.exit("La validación de accesos falló. Deteniendo la ejecución.")
-
-
-
-
 # Variables globales para conteo de operaciones
 tests_updated_successfully = 0
 tests_updated_failed = 0
@@ -50,18 +42,54 @@ cache_paths = {
     "urls": "/tmp/urls/"
 }
 
+# Presupuesto opcional de memoria por caché (desalojo LRU); 0 = sin límite
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 0)) or None
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 0)) or None
+
+# Cachés abiertas bajo demanda y compartidas entre lookUpdatedTest y main
+cache_registry = CacheRegistry(cache_paths, lazy=True, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, flusher=True)
+
+# Estado normalizado de cloud por key (leído en lookUpdatedTest) para omitir mutaciones sin cambios
+cloud_states = {}
+
+# Resultado de la asociación masiva de test sets y precondiciones (--bulk-associate)
+bulk_association = None
+
 # Número global de hilo
 NUM_THREADS = 25  # Ajusta según tus necesidades
 
+# --pipeline: hilos por etapa ("body=8,test_sets=4,...") y tamaño de cada cola
+PIPELINE_STAGE_WORKERS = {'body': 10, 'test_sets': 5, 'precondition_update': 5, 'precondition_link': 5}
+PIPELINE_STAGE_WORKERS.update({name: int(workers) for name, workers in
+                               (item.split('=') for item in os.getenv('PIPELINE_STAGE_WORKERS', '').split(',') if item)})
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 50))
+PIPELINE_REPORT_SECONDS = float(os.getenv('PIPELINE_REPORT_SECONDS', 10))
+
+def validate_access():
+    # Validar accesos (llamada real a Xray Cloud: solo al ejecutar el script, no al importarlo)
+    res = accessValidator()
+    if res == 0:
+        logger.info("...Accesos Validados...")
+        logger.info("****************************************************")
+    else:
+        logger.error(f"...Accesos NO Validados [{res}]...")
+        logger.info("****************************************************")
+        sys.exit("La validación de accesos falló. Deteniendo la ejecución.")
+
 def process_key(keyIssueServer):
     client = get_next_client()
     set_thread_local_account(client)
     
-    if cache_cloud.get_data(keyIssueServer):  # Buscamos issues que si existen en cache
-        dataServer = cache_server.get_data(keyIssueServer).json
-        process_testcases(dataServer, cache_cloud.get_data(keyIssueServer).json)
-    else:  # Buscamos issues que no existen en cache
-        print(f"No existe en cloud asi que buscamos por API {keyIssueServer}")
+    try:
+        if cache_cloud.get_data(keyIssueServer):  # Buscamos issues que si existen en cache
+            dataServer = cache_server.get_data(keyIssueServer).json
+            process_testcases(dataServer, cache_cloud.get_data(keyIssueServer).json, cloud_states.get(keyIssueServer), bulk_association)
+        else:  # Buscamos issues que no existen en cache
+            print(f"No existe en cloud asi que buscamos por API {keyIssueServer}")
+    finally:
+        # El cliente pudo cambiar si fue reasignado tras un 429
+        release_client(get_thread_local_account())
+        set_thread_local_account(None)
 
 def process_keys(filtered_keys, max_to_process):
     global tests_updated_successfully, tests_updated_failed
@@ -82,36 +110,62 @@ def process_keys(filtered_keys, max_to_process):
                 logger.error(f"Error procesando key: {e}")
                 tests_updated_failed += 1
 
-def main(sortProject=[], testToProcess=[]):
-    global cache_server, cache_cloud
+    for client_id, stats in get_client_utilization().items():
+        logger.info(f"Cliente {client_id}: {stats}")
 
-    caches_server = {key: CacheIssue(f'{path}in/', f'{path}out/', key, "server") for key, path in cache_paths.items()}
-    caches_cloud = {key: CacheIssue(f'{path}in/', f'{path}out/', key, "cloud") for key, path in cache_paths.items()}
+def acquire_thread_client():
+    set_thread_local_account(get_next_client())
 
-    cache_server = caches_server["testcases"]
-    cache_cloud = caches_cloud["testcases"]
+def release_thread_client():
+    # El cliente pudo cambiar si fue reasignado tras un 429
+    release_client(get_thread_local_account())
+    set_thread_local_account(None)
+
+def process_keys_pipeline(filtered_keys, max_to_process):
+    global tests_updated_successfully, tests_updated_failed
+    # Cada hilo de etapa tiene su cliente durante toda la ejecución
+    stages = [(name, stage, PIPELINE_STAGE_WORKERS[name]) for name, stage in TEST_STAGES]
+    pipeline = Pipeline(stages, queue_size=PIPELINE_QUEUE_SIZE, on_thread_start=acquire_thread_client,
+                        on_thread_end=release_thread_client, report_interval=PIPELINE_REPORT_SECONDS).start()
+    tasks = []
+    try:
+        for keyIssueServer in filtered_keys:
+            if len(tasks) >= max_to_process:
+                break  # Detiene la iteración si se ha alcanzado el máximo
+            testCloud = cache_cloud.get_data(keyIssueServer)
+            if not testCloud:
+                print(f"No existe en cloud asi que buscamos por API {keyIssueServer}")
+                continue
+            task = new_task(cache_server.get_data(keyIssueServer).json, testCloud.json, cloud_states.get(keyIssueServer), bulk_association)
+            tasks.append(task)
+            pipeline.submit(task)
+    finally:
+        pipeline.close()
+
+    for task in tasks:
+        if task['failed']:
+            tests_updated_failed += 1
+        else:
+            tests_updated_successfully += 1
+
+def main(sortProject=[], testToProcess=[], changed_keys=None):
+    global cache_server, cache_cloud, bulk_association
+
+    # Solo se usan los testcases: server y cloud se cargan en paralelo
+    cache_registry.warm(["testcases"])
+    cache_server = cache_registry.get("testcases", "server")
+    cache_cloud = cache_registry.get("testcases", "cloud")
 
     max_to_process = 20  # Define cuántos elementos quieres procesar
 
-    # Leer claves de ErrorTestCase.json
-    error_testcases_file = 'logs/ErrorTestCase.json'
-    error_testcases = []
-    if os.path.exists(error_testcases_file):
-        with open(error_testcases_file, 'r', encoding='utf-8') as f:
-            error_testcases = [entry['key'] for entry in json.load(f)]
-        # Vaciar el contenido de ErrorTestCase.json después de leer
-        with open(error_testcases_file, 'w', encoding='utf-8') as f:
-            json.dump([], f)
-
-    # Leer claves ya procesadas de TestCaseReady.json
-    test_case_ready_file = 'logs/TestCaseReady.json'
-    test_case_ready = []
-    if os.path.exists(test_case_ready_file):
-        with open(test_case_ready_file, 'r', encoding='utf-8') as f:
-            test_case_ready = json.load(f)
+    ledger = get_ledger()
+
+    # Claves con error en ejecuciones anteriores (se reintentan) y claves ya listas
+    error_testcases = ledger.tests_in_state(ERROR)
+    test_case_ready = set(ledger.tests_in_state(READY))
 
     # Combinar claves fallidas con nuevas claves a procesar, excluyendo las que ya están listas
-    all_test_to_process = list(set(testToProcess + error_testcases) - set(test_case_ready))
+    all_test_to_process = list(set(testToProcess + error_testcases) - test_case_ready)
 
     def filter_keys(keys, sortProject, testToProcess):
         filtered_keys = set()
@@ -139,49 +193,70 @@ def main(sortProject=[], testToProcess=[]):
 
     # Primera ejecución
     logger.info("Primera ejecución del procesamiento de claves.")
+    run_started_at = time.time()
     all_keys = cache_server.get_keys()
     filtered_keys = filter_keys(all_keys, sortProject, all_test_to_process)
-    process_keys(filtered_keys, max_to_process)
-
-    # Leer claves procesadas y actualizar registros
-    processed_successfully = []
-    if os.path.exists(test_case_ready_file):
-        with open(test_case_ready_file, 'r', encoding='utf-8') as f:
-            processed_successfully = json.load(f)
-
-    # Segunda ejecución para reprocesar errores
-    if os.path.exists(error_testcases_file):
-        with open(error_testcases_file, 'r', encoding='utf-8') as f:
-            error_testcases = [entry['key'] for entry in json.load(f)]
-
-        if error_testcases:
-            logger.info(f"Reprocesando {len(error_testcases)} tests fallidos.")
-            process_keys(error_testcases, max_to_process)
-            
-            # Leer claves procesadas y actualizar ErrorTestCase.json
-            error_testcases = []
-            if os.path.exists(error_testcases_file):
-                with open(error_testcases_file, 'r', encoding='utf-8') as f:
-                    error_testcases = json.load(f)
-
-            error_testcases_dict = {entry['key']: entry for entry in error_testcases}
-            with open(test_case_ready_file, 'r', encoding='utf-8') as f:
-                test_case_ready = json.load(f)
-            
-            for key in test_case_ready:
-                if key in error_testcases_dict:
-                    del error_testcases_dict[key]
-
-            with open(error_testcases_file, 'w', encoding='utf-8') as f:
-                json.dump(list(error_testcases_dict.values()), f, indent=4)
-            
-            logger.info(f"Finalizado el reprocesamiento de tests fallidos. Total resueltos: {tests_updated_successfully}, Total no resueltos: {tests_updated_failed}")
-
-def lookUpdatedTest(filter_keys=None):
-    caches_cloud = {key: CacheIssue(f'{path}in/', f'{path}out/', key, "cloud") for key, path in cache_paths.items()}
-    caches_server = {key: CacheIssue(f'{path}in/', f'{path}out/', key, "server") for key, path in cache_paths.items()}
-
-    cache_server = caches_server["testcases"]
+    if changed_keys is not None:
+        # Sincronización incremental: solo las keys que cambiaron desde la última marca de agua
+        # y las que quedaron con error en ejecuciones anteriores (primero las que cambiaron)
+        changed_keys = set(changed_keys)
+        retry_keys = set(error_testcases)
+        filtered_keys = sorted((key for key in filtered_keys if key in changed_keys or key in retry_keys),
+                               key=lambda key: key not in changed_keys)
+    if config.bulk_import:
+        # Tipo, pasos y definición por importación masiva; los rechazados siguen por mutaciones.
+        # Tope propio (--bulk-import-limit): la importación masiva está pensada para proyectos
+        # completos y no se limita a los max_to_process tests del procesamiento por mutaciones
+        imported, failed = bulk_import_tests(filtered_keys[:config.bulk_import_limit], cache_server)
+        logger.info(f"Importación masiva: {len(imported)} importados, {len(failed)} con error")
+        for key in imported:
+            cloud_states.pop(key, None)  # El estado de cloud leído antes de importar ya no vale
+
+    if config.bulk_associate:
+        # Vincular test sets y precondiciones con una mutación por destino en lugar de una por test,
+        # solo para los tests que run_keys va a procesar y que aún no están listos
+        associate_keys = [key for key in filtered_keys[:max_to_process] if not ledger.is_test_ready(key)]
+        bulk_association = associate_in_bulk(associate_keys, cache_server, cache_cloud, config.ambiente)
+        logger.info(f"Asociación masiva: {bulk_association['mutations']} mutaciones")
+
+    run_keys = process_keys_pipeline if config.pipeline else process_keys
+    run_keys(filtered_keys, max_to_process)
+
+    # Segunda ejecución para reprocesar los errores de esta ejecución
+    error_testcases = ledger.tests_in_state(ERROR, since=run_started_at)
+    if error_testcases:
+        logger.info(f"Reprocesando {len(error_testcases)} tests fallidos.")
+        # El reproceso vincula test sets y precondiciones test a test
+        bulk_association = None
+        run_keys(error_testcases, max_to_process)
+        logger.info(f"Finalizado el reprocesamiento de tests fallidos. Total resueltos: {tests_updated_successfully}, Total no resueltos: {tests_updated_failed}")
+
+    # Mantener los logs/*.json con el formato histórico
+    ledger.export_json()
+
+    logger.info(f"Caché server testcases: {cache_server.get_stats()}")
+    logger.info(f"Caché cloud testcases: {cache_cloud.get_stats()}")
+    if retry_util.HTTP_CACHE_ENABLED:
+        logger.info(f"Caché HTTP: {retry_util.get_http_cache().get_stats()}")
+
+def fetch_test_cases_updated(batches):
+    if config.engine == 'async':
+        # Todas las consultas en vuelo desde un solo hilo (asyncio/aiohttp)
+        import async_transport
+        return async_transport.run(async_transport.gather_limited(
+            async_transport.getTestCasesUpdated_async(batch) for batch in batches))
+
+    # Usar ThreadPoolExecutor para realizar consultas en paralelo
+    results = []
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = {executor.submit(getTestCasesUpdated, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+def lookUpdatedTest(filter_keys=None, incremental=False):
+    # Misma instancia que usará main en esta ejecución
+    cache_server = cache_registry.get("testcases", "server")
     
     if filter_keys:
         filter_keys = filter_keys.split(',')
@@ -197,59 +272,79 @@ def lookUpdatedTest(filter_keys=None):
     else:
         filtered_keys = cache_keys
 
-    # Abre el archivo JSON para leer los test cases ya listos
-    with open('logs/TestCaseReady.json', 'r') as file:
-        testCasesReady = json.load(file)
+    # Test cases ya listos según el ledger de progreso
+    ledger = get_ledger()
+    testCasesReady = set(ledger.tests_in_state(READY))
     
     # Calcula la diferencia entre las keys filtradas y las ya listas
-    difference = list(set(filtered_keys) - set(testCasesReady))
+    difference = list(set(filtered_keys) - testCasesReady)
+
+    # Sincronización incremental: solo las keys que cambiaron desde la última marca de agua
+    sync_started_at = time.time()
+    if incremental:
+        changed, projects = select_changed_keys(difference, ledger)
+        logger.info(f"Sincronización incremental: {len(changed)} de {len(difference)} tests pendientes cambiaron")
+        difference = list(changed)
     
     # Lista para guardar las keys de los test cases que necesitan edición
     test_cases_to_update = []
+    cloud_modified = {}
 
     # Paginación - Procesar en lotes de 100
     batch_size = 100
     batches = [difference[i:i + batch_size] for i in range(0, len(difference), batch_size)]
     
-    # Usar ThreadPoolExecutor para realizar consultas en paralelo
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(getTestCasesUpdated, batch): batch for batch in batches}
-        
-        for future in as_completed(futures):
-            test_cases_data = future.result()
-            
-            # Procesar cada test case en el batch
-            for testcase in test_cases_data["data"]["getTests"]["results"]:
-                key = testcase["jira"]["key"]
-                test_type = testcase["testType"]["kind"]
-                steps = testcase.get("steps", None)
-                gherkin_content = testcase.get("gherkin", None)
-                #print(f"steps: {steps}")
-                if test_type == "Steps" and steps:
-                    # Manual test case with steps, should be updated
+    for test_cases_data in fetch_test_cases_updated(batches):
+        # Procesar cada test case en el batch
+        for testcase in test_cases_data["data"]["getTests"]["results"]:
+            key = testcase["jira"]["key"]
+            cloud_modified[key] = testcase.get("lastModified")
+            cloud_states[key] = cloud_state(testcase)
+            test_type = testcase["testType"]["kind"]
+            steps = testcase.get("steps", None)
+            gherkin_content = testcase.get("gherkin", None)
+            #print(f"steps: {steps}")
+            if test_type == "Steps" and steps:
+                # Manual test case with steps, should be updated
+                test_cases_to_update.append(key)
+            elif test_type in ["Gherkin", "Cucumber"]:
+                if gherkin_content and gherkin_content != "{}":
+                    # Cucumber/Gherkin test case with valid content
                     test_cases_to_update.append(key)
-                elif test_type in ["Gherkin", "Cucumber"]:
-                    if gherkin_content and gherkin_content != "{}":
-                        # Cucumber/Gherkin test case with valid content
-                        test_cases_to_update.append(key)
     
-    # Guardar las keys en el archivo TestCasesUpdated.json
-    with open('logs/TestCasesUpdated.json', 'w') as outfile:
-        json.dump(test_cases_to_update, outfile, indent=4)
+    # Registrar cuáles de las keys consultadas ya tienen contenido en cloud
+    ledger.set_tests_updated(difference, test_cases_to_update)
+    ledger.set_key_watermarks(cloud_modified)
+    if incremental:
+        # La próxima ejecución solo revisará lo que cambie desde el inicio de esta
+        ledger.set_project_watermarks(projects, sync_started_at)
+    ledger.export_json()
     
     print(f"Test cases to update: {test_cases_to_update}")
+    return difference
 
 if __name__ == "__main__":
-    
+    validate_access()
+
     print(config.sort)
     print(config.process)
     if config.process == "ALL":
         config.process=[]
 
-    lookUpdatedTest(config.process)
+    # Una conexión keep-alive por hilo de trabajo en cada sesión del pool
+    retry_util.configure_session_pool(NUM_THREADS)
+
+    # Cargar en paralelo las cachés que usan ambas fases
+    cache_registry.warm(["testcases"])
+
+    changed_keys = lookUpdatedTest(config.process, incremental=config.incremental)
     sortProject = config.sort.split(',') if config.sort else []
     testToProcess = config.process.split(',') if config.process else []
     print(f"sortProject: {sortProject}")
     print(f"testToProcess {testToProcess}")
-    main(sortProject, testToProcess)
+    try:
+        main(sortProject, testToProcess, changed_keys if config.incremental else None)
+    finally:
+        cache_registry.close_all()
+        retry_util.close_sessions()
 
@@ -1,106 +1,94 @@
 import logging
-import json
-import os
 import config
 from xray_service import (
-    update_test_type,
-    update_gherkin_test_definition,
-    update_unstructured_test_definition,
-    add_test_step,
+    update_test_type_mutation,
+    update_gherkin_test_definition_mutation,
+    update_unstructured_test_definition_mutation,
+    add_test_step_mutation,
+    send_test_mutations,
     update_precondition,
     add_preconditions_to_test,
     add_test_sets_to_test,
     escape_definition_text
 )
+from id_lookup import get_precondition_index, get_test_set_index, resolve_precondition_ids
+import threading
+from progress_ledger import get_ledger, READY
+from single_flight import SingleFlight
+from content_hash import server_state, body_hash, missing_steps
 logger = logging.getLogger()
 
-# Leer archivo preconditions.json
-def read_preconditions():
-    with open('preconditions.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-preconditions_data = read_preconditions()
-
-# Leer archivo testSets.json
-def read_test_sets():
-    with open('testSets.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-test_sets_data = read_test_sets()
-
 def get_precondition_id(precondition_key):
-    for issue in preconditions_data['issues']:
-        if issue['key'] == precondition_key:
-            return issue.get(f'id{config.ambiente}')
-    return None
+    return get_precondition_index().get(precondition_key, config.ambiente)
 
 def get_test_set_ids(test_key):
-    for issue in test_sets_data['issues']:
-        if issue['key'] == test_key:
-            return [ts.get(f'id{config.ambiente}') for ts in issue.get('associated_test_sets', [])]
-    return []
+    return get_test_set_index().get(test_key, config.ambiente, [])
 
 def log_error(test_key, error_message):
-    log_file = 'logs/ErrorTestCase.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            errors = json.load(f)
-    else:
-        errors = []
-
-    errors.append({'key': test_key, 'error': error_message})
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(errors, f, indent=4)
+    get_ledger().mark_test_error(test_key, error_message)
 
 def log_test_case_ready(test_key):
-    log_file = 'logs/TestCaseReady.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            test_cases = json.load(f)
-    else:
-        test_cases = []
-
-    test_cases.append(test_key)
+    get_ledger().mark_test_ready(test_key)
 
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(test_cases, f, indent=4)
+def log_test_case_updated(test_key):
+    get_ledger().mark_test_updated(test_key)
 
 def log_precondition_ready(precondition_key):
-    log_file = 'logs/preconditionReadyUpdated.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            preconditions = json.load(f)
-    else:
-        preconditions = []
-
-    preconditions.append(precondition_key)
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(preconditions, f, indent=4)
+    get_ledger().mark_precondition_ready(precondition_key)
 
 def log_precondition_error(precondition_key, error_message):
-    log_file = 'logs/preconditionError.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            errors = json.load(f)
-    else:
-        errors = []
-
-    errors.append({'key': precondition_key, 'error': error_message})
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(errors, f, indent=4)
-
-def has_been_processed(test_key, processed_tests):
-    return test_key in processed_tests
-
-def has_been_processed_precondition(precondition_key, processed_preconditions):
-    return precondition_key in processed_preconditions
-
-def process_testcases(testServer, testCloud):
-    issue_id = testCloud['id']
-    test_key = testServer.get("key")
+    get_ledger().mark_precondition_error(precondition_key, error_message)
+
+def has_been_processed(test_key):
+    return get_ledger().is_test_ready(test_key)
+
+def has_been_updated(test_key):
+    return get_ledger().is_test_updated(test_key)
+
+def has_been_processed_precondition(precondition_key):
+    return get_ledger().is_precondition_ready(precondition_key)
+
+# Actualizaciones de precondiciones compartidas por varios tests: una sola por precondición
+# en todo el proceso, partiendo de las ya listas en el ledger
+precondition_updates = None
+precondition_updates_lock = threading.Lock()
+
+def get_precondition_updates():
+    global precondition_updates
+    with precondition_updates_lock:
+        if precondition_updates is None:
+            precondition_updates = SingleFlight(get_ledger().preconditions_in_state(READY))
+    return precondition_updates
+
+# Etapas del procesamiento de un test. process_testcases las ejecuta en orden en el hilo
+# actual; con --pipeline cada etapa tiene su propia cola y sus hilos (pipeline.py).
+# El estado de un test entre etapas viaja en un dict 'task'.
+
+def new_task(testServer, testCloud, cloud=None, bulk=None):
+    # cloud: estado normalizado de cloud (content_hash.cloud_state) leído en lookUpdatedTest;
+    # si está, solo se envían las mutaciones de las partes que difieren del server.
+    # bulk: resultado de bulk_association.associate_in_bulk; si está, los test sets y las
+    # precondiciones ya listas se vincularon en bloque y no se envían por test (solo para
+    # los tests incluidos en la asociación masiva; el resto sigue el camino por test)
+    key = testServer.get("key")
+    if bulk is not None and key not in bulk['keys']:
+        bulk = None
+    return {
+        'server': testServer,
+        'issue_id': testCloud['id'],
+        'key': key,
+        'cloud': cloud,
+        'bulk': bulk,
+        'failed': False,  # Error en tipo/definición/test sets: no se marca como listo
+        'precondition_ids': []
+    }
+
+def update_test_body(task):
+    # Etapa 1: tipo de test y pasos/definición. Devuelve False si el test ya estaba listo.
+    testServer = task['server']
+    issue_id = task['issue_id']
+    test_key = task['key']
+    cloud = task['cloud']
     test_type = testServer.get('type')
     print(test_type)
     definition = testServer.get('definition')
@@ -109,46 +97,85 @@ def process_testcases(testServer, testCloud):
     logger.info(f"Processing test: {test_key} with type: {test_type}")
 
     try:
-        with open('logs/TestCaseReady.json', 'r', encoding='utf-8') as f:
-            processed_tests = json.load(f)
-        
-        with open('logs/TestCasesUpdated.json', 'r', encoding='utf-8') as f:
-            updated_tests = json.load(f)
-
-        if has_been_processed(test_key, processed_tests):
+        if has_been_processed(test_key):
             logger.info(f"Test Case {test_key} already processed.")
             print("Test Case ignorado")
-            return
+            return False
+
+        server = server_state(testServer, config.ambiente) if cloud is not None else None
         
-        # Verificar si el test case ya ha sido actualizado
-        if test_key in updated_tests:
+        # Verificar si el test case ya coincide con cloud o ya ha sido actualizado
+        if cloud is not None and body_hash(server) == body_hash(cloud):
+            logger.info(f"Test Case {test_key} already matches cloud. Skipping type and definition update.")
+            print("Test Case igual en cloud, omitiendo actualización de tipo y definición.")
+            log_test_case_updated(test_key)
+        elif cloud is None and has_been_updated(test_key):
             logger.info(f"Test Case {test_key} already updated. Skipping type and definition update.")
             print("Test Case ya actualizado previamente, omitiendo actualización de tipo y definición.")
         else:
-            # Actualizar el tipo de test
-            update_test_type(issue_id, test_type)
-
+            # Si cloud ya tiene los primeros pasos solo faltan los siguientes; si tiene otros
+            # pasos no se toca el test (se duplicarían)
+            pending_steps = range(len(steps))
+            if test_type == 'Manual' and cloud is not None:
+                pending_steps = missing_steps(server, cloud)
+                if pending_steps is None:
+                    raise Exception(f"Cloud steps of {test_key} differ from server steps; not adding steps to avoid duplicates")
+
+            # El tipo va en su propio documento: si falla no se envían pasos ni definición
+            if cloud is None or cloud['type'] != test_type:
+                send_test_mutations(issue_id, [("updating test type", update_test_type_mutation(issue_id, test_type))])
+
+            # Pasos o definición en un solo documento GraphQL
+            mutations = []
             if test_type == 'Manual':
-                # Iterar sobre los pasos del test manual y agregarlos
-                for step in steps:
+                # Agregar los pasos del test manual (se ejecutan en orden dentro del documento)
+                for index in pending_steps:
+                    step = steps[index]
+                    number = index + 1
                     action = step.get('fields').get('Action')
                     data = step.get('fields').get('Data')
                     result = step.get('fields').get('ExpectedResult')
-                    add_test_step(issue_id, action, data, result)
-            else:
+                    mutations.append((f"adding test step {number}", add_test_step_mutation(issue_id, action, data, result)))
+            elif cloud is None or cloud['definition'] != server['definition']:
                 # Actualizar la definición del test
                 if test_type == 'Cucumber':
-                    update_gherkin_test_definition(issue_id, definition)
+                    mutations.append(("updating gherkin test definition", update_gherkin_test_definition_mutation(issue_id, definition)))
                 else:
-                    update_unstructured_test_definition(issue_id, definition)
+                    mutations.append(("updating unstructured test definition", update_unstructured_test_definition_mutation(issue_id, definition)))
+
+            if mutations:
+                send_test_mutations(issue_id, mutations)
             
             # Registrar que este test case ya ha sido actualizado
-            updated_tests.append(test_key)
-            with open('logs/TestCasesUpdated.json', 'w', encoding='utf-8') as f:
-                json.dump(updated_tests, f, indent=4)
+            log_test_case_updated(test_key)
+    except Exception as e:
+        logger.error(f"Error procesando test case {test_key}: {e}")
+        log_error(test_key, str(e))
+        print("Test Case con Error")
+        task['failed'] = True
 
-        # Continuar con la parte de test sets y precondiciones
-        test_set_ids = get_test_set_ids(test_key)
+def associate_test_sets(task):
+    # Etapa 2: test sets y paso del test a listo
+    if task['failed']:
+        return
+    issue_id = task['issue_id']
+    test_key = task['key']
+    cloud = task['cloud']
+    bulk = task['bulk']
+
+    try:
+        if bulk is not None:
+            test_set_ids = []
+            if test_key in bulk['test_sets_failed']:
+                log_error(test_key, "Error associating test sets in bulk")
+                print(f"Error al asociar test sets a {test_key}")
+                task['failed'] = True
+                return
+        else:
+            test_set_ids = get_test_set_ids(test_key)
+        if cloud is not None and bulk is None:
+            # Solo los test sets que aún no están asociados en cloud
+            test_set_ids = [test_set_id for test_set_id in test_set_ids if test_set_id and str(test_set_id) not in cloud['test_sets']]
         print(f"test_set_ids: {test_set_ids}")
         if test_set_ids:
             try:
@@ -166,40 +193,84 @@ def process_testcases(testServer, testCloud):
         logger.error(f"Error procesando test case {test_key}: {e}")
         log_error(test_key, str(e))
         print("Test Case con Error")
+        task['failed'] = True
+
+def update_test_preconditions(task):
+    # Etapa 3: actualizar las precondiciones aún no migradas
+    test_key = task['key']
 
     try:
-        # Procesar precondiciones
-        preconditions = testServer.get('precondition', [])
-        precondition_ids = []
-        with open('logs/preconditionReadyUpdated.json', 'r', encoding='utf-8') as f:
-            processed_preconditions = json.load(f)
+        preconditions = task['server'].get('precondition', [])
+        precondition_ids = task['precondition_ids']
+        resolved_ids = resolve_precondition_ids([p.get('preconditionKey') for p in preconditions], config.ambiente)
 
         for precondition in preconditions:
             precondition_key = precondition.get('preconditionKey')
-            precondition_id = get_precondition_id(precondition_key)
+            precondition_id = resolved_ids.get(precondition_key)
 
             if precondition_id:
-                if not has_been_processed_precondition(precondition_key, processed_preconditions):
-                    precondition_type = precondition.get('type')
-                    precondition_definition = precondition.get('condition')
+                def update(precondition=precondition, precondition_key=precondition_key, precondition_id=precondition_id):
                     try:
-                        update_precondition(precondition_id, precondition_type, precondition_definition)
-                        precondition_ids.append(precondition_id)
-                        log_precondition_ready(precondition_key)
-                        print("Precondition vinculada y Actualizada")
+                        update_precondition(precondition_id, precondition.get('type'), precondition.get('condition'))
                     except Exception as e:
+                        # Solo el hilo que hizo la actualización registra el error
                         logger.error(f"Error updating precondition {precondition_key}: {e}")
                         log_precondition_error(precondition_key, str(e))
-                        print("Error al actualizar Precondition")
+                        raise
+                    log_precondition_ready(precondition_key)
+
+                try:
+                    # Si otro hilo la está actualizando se espera su resultado
+                    updated = get_precondition_updates().run(precondition_key, update)
+                except Exception:
+                    print("Error al actualizar Precondition")
+                    continue
+                precondition_ids.append(precondition_id)
+                if updated:
+                    print("Precondition vinculada y Actualizada")
                 else:
-                    precondition_ids.append(precondition_id)
                     print("Precondition no Actualizada pero si vinculada")
+    except Exception as e:
+        logger.error(f"Error procesando precondiciones para {test_key}: {e}")
+        log_error(test_key, str(e))
+        return False
+
+def link_test_preconditions(task):
+    # Etapa 4: vincular las precondiciones al test
+    test_key = task['key']
+    cloud = task['cloud']
+    precondition_ids = task['precondition_ids']
+    bulk = task['bulk']
+
+    try:
+        if bulk is not None:
+            # Las ya vinculadas con addTestsToPrecondition no se repiten; las que no estaban
+            # listas al asociar en bloque o cuyo bloque falló se vinculan aquí
+            linked = bulk['preconditions_linked'].get(test_key, set())
+            precondition_ids = [precondition_id for precondition_id in precondition_ids if str(precondition_id) not in linked]
+        if cloud is not None:
+            # Solo las precondiciones que aún no están vinculadas en cloud
+            precondition_ids = [precondition_id for precondition_id in precondition_ids if str(precondition_id) not in cloud['preconditions']]
 
         if precondition_ids:
-            res = add_preconditions_to_test(issue_id, precondition_ids)
+            res = add_preconditions_to_test(task['issue_id'], precondition_ids)
             print(res)
     except Exception as e:
         logger.error(f"Error procesando precondiciones para {test_key}: {e}")
         log_error(test_key, str(e))
 
     logger.info(f"Finished processing test: {test_key}")
+
+# Orden de las etapas; una etapa que devuelve False termina el procesamiento del test
+TEST_STAGES = [
+    ('body', update_test_body),
+    ('test_sets', associate_test_sets),
+    ('precondition_update', update_test_preconditions),
+    ('precondition_link', link_test_preconditions)
+]
+
+def process_testcases(testServer, testCloud, cloud=None, bulk=None):
+    task = new_task(testServer, testCloud, cloud, bulk)
+    for name, stage in TEST_STAGES:
+        if stage(task) is False:
+            return
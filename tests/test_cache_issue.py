@@ -0,0 +1,42 @@
+import json
+
+from CacheIssue import CacheIssue
+from Issue import Issue
+
+
+def make_cache(tmp_path, **kwargs):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    output_dir.mkdir()
+    with open(input_dir / 'testcases_server_0001.jsonl', 'w') as file:
+        file.write(json.dumps({'key': 'T-1', 'json': {'key': 'T-1', 'version': 1}}) + '\n')
+    return CacheIssue(f"{input_dir}/", f"{output_dir}/", 'testcases', lazy=True, **kwargs)
+
+
+def test_read_after_flush_returns_new_version(tmp_path):
+    cache = make_cache(tmp_path)
+    try:
+        assert cache.get_data('T-1').json['version'] == 1
+
+        cache.add_element(Issue('T-1', {'key': 'T-1', 'version': 2}))
+        cache.flush()
+        assert cache.get_stats()['resident_entries'] == 0
+        assert cache.resident_bytes == 0
+
+        assert cache.get_data('T-1').json['version'] == 2
+    finally:
+        cache.close()
+
+
+def test_read_after_flush_with_memory_budget(tmp_path):
+    cache = make_cache(tmp_path, max_entries=10)
+    try:
+        cache.get_data('T-1')
+        cache.add_element(Issue('T-1', {'key': 'T-1', 'version': 2}))
+        cache.flush()
+        cache.get_data('T-1')
+
+        assert cache.get_data('T-1').json['version'] == 2
+    finally:
+        cache.close()
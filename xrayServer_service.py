@@ -1,5 +1,9 @@
-import requests
 import os
+import itertools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from retry_util import retry_request, make_request
 load_dotenv()
@@ -11,6 +15,12 @@ API_TOKEN_SERVER = os.getenv('API_TOKEN_SERVER')
 RETRIES = 10
 DELAY = 6
 
+# Paginación de tests por test execution
+PAGE_LIMIT = 100
+PREFETCH_PAGES = int(os.getenv('XRAY_SERVER_PREFETCH_PAGES', 4))
+MAX_EXECUTIONS_IN_FLIGHT = int(os.getenv('XRAY_SERVER_EXECUTIONS_IN_FLIGHT', 8))
+RESULTS_QUEUE_SIZE = 1000
+
 def get_test_executions_for_test_plan(testPlanKey):
     url = f"{JIRA_BASE_URL_SERVER}/rest/raven/1.0/api/testplan/{testPlanKey}/testexecution"
     headers = {
@@ -19,34 +29,92 @@ def get_test_executions_for_test_plan(testPlanKey):
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=RETRIES, delay=DELAY)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=RETRIES, delay=DELAY)
     return response.json()
 
-# Obtener test de TestExecutions
-def get_tests_for_testExecutions(testExecKey):
-    url = f"{JIRA_BASE_URL_SERVER}/rest/raven/1.0/api/testexec/{testExecKey}/test?detailed=true"
+def fetch_tests_page(testExecKey, page, limit):
+    url = f"{JIRA_BASE_URL_SERVER}/rest/raven/1.0/api/testexec/{testExecKey}/test"
     headers = {
         'Accept': 'application/json',
         'Authorization': f'Bearer {API_TOKEN_SERVER}'
     }
+    params = {'detailed': 'true', 'limit': limit, 'page': page}
+
+    #print(f"Fetching URL: {url} (page={page})")
+    response = retry_request(make_request, None, url, method='GET', headers=headers, params=params, retries=RETRIES, delay=DELAY)
+    return response.json() or []
+
+# Obtener test de TestExecutions página a página
+def iter_tests_for_testExecution(testExecKey, limit=PAGE_LIMIT, prefetch=None):
+    # Se piden por adelantado las siguientes 'prefetch' páginas; se entrega cada página en
+    # orden y se corta en la primera página incompleta (las especulativas se cancelan)
+    prefetch = prefetch or PREFETCH_PAGES
+    pages = itertools.count(1)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        for _ in range(prefetch):
+            pending.append(executor.submit(fetch_tests_page, testExecKey, next(pages), limit))
+
+        while pending:
+            data = pending.popleft().result()
+            yield from data
+            if len(data) < limit:
+                return
+            pending.append(executor.submit(fetch_tests_page, testExecKey, next(pages), limit))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def get_tests_for_testExecutions(testExecKey):
+    return list(iter_tests_for_testExecution(testExecKey))
+
+def iter_tests_for_test_plan(testPlanKey, max_in_flight=None):
+    # Recorre en paralelo las test executions del test plan y entrega (testExecKey, test)
+    # a medida que llegan; la cola acotada evita acumular ejecuciones completas en memoria
+    max_in_flight = max_in_flight or MAX_EXECUTIONS_IN_FLIGHT
+    exec_keys = [execution['key'] for execution in get_test_executions_for_test_plan(testPlanKey)]
+    results = queue.Queue(maxsize=RESULTS_QUEUE_SIZE)
+    stop = threading.Event()
 
-    all_tests = []
-    page = 1
-    limit = 100
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-    while True:
-        paginated_url = f"{url}?limit={limit}&page={page}"
-        #print(f"Fetching URL: {paginated_url}")
-        response = retry_request(make_request, paginated_url, method='GET', headers=headers, retries=RETRIES, delay=DELAY)
-        data = response.json()
-        
-        if not data:
-            break
+    def worker(testExecKey):
+        tests = iter_tests_for_testExecution(testExecKey)
+        try:
+            for test in tests:
+                if not put((testExecKey, test, None)):
+                    return
+        except Exception as e:
+            put((testExecKey, None, e))
+        finally:
+            tests.close()
+            put(None)
 
-        all_tests.extend(data)
-        page += 1
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(exec_keys))))
+    try:
+        for testExecKey in exec_keys:
+            executor.submit(worker, testExecKey)
 
-    return all_tests
+        remaining = len(exec_keys)
+        while remaining:
+            item = results.get()
+            if item is None:
+                remaining -= 1
+                continue
+            testExecKey, test, error = item
+            if error is not None:
+                raise error
+            yield testExecKey, test
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def getTestRun(testExecution,testRun):
     url = f"{JIRA_BASE_URL_SERVER}/rest/raven/2.0/api/testrun?testExecIssueKey={testExecution}&testIssueKey={testRun}"
@@ -56,7 +124,7 @@ def getTestRun(testExecution,testRun):
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=RETRIES, delay=DELAY)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=RETRIES, delay=DELAY)
     return response.json()
 
 def getStatusXrayServer():
@@ -67,7 +135,7 @@ def getStatusXrayServer():
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=2, delay=1)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=2, delay=1)
     return response.json()
     
     
@@ -79,6 +147,6 @@ def getTestInfo(keyTest):
     }
 
     print(f"Fetching URL: {url}")
-    response = retry_request(make_request, url, method='GET', headers=headers, retries=2, delay=1)
+    response = retry_request(make_request, None, url, method='GET', headers=headers, retries=2, delay=1)
     return response.json()
     
\ No newline at end of file
@@ -0,0 +1,128 @@
+# xray_import_standin.py
+#
+# Servidor local que emula los endpoints de Xray Cloud que usa bulk_import.py, para probar
+# la importación masiva sin tocar Xray Cloud:
+#   POST /api/v2/authenticate
+#   POST /api/v2/import/test/bulk
+#   GET  /api/v2/import/test/bulk/{jobId}/status
+# Los jobs quedan en 'working' durante las primeras consultas y luego terminan. Un test sin
+# testtype o update_key, o un Manual sin pasos, se rechaza como hace la API real con datos inválidos.
+# Uso: python xray_import_standin.py [--port 8089] [--polls 1]
+#      XRAY_REST_BASE_URL=http://localhost:8089/api/v2 python subirinfo.py --ambiente DEV --bulk-import
+
+import argparse
+import itertools
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+jobs = {}
+jobs_lock = threading.Lock()
+issue_ids = itertools.count(10000)
+POLLS_BEFORE_DONE = 1
+
+
+def validate(test):
+    errors = {}
+    if not test.get('testtype'):
+        errors['testtype'] = 'Test Type is required.'
+    if not test.get('update_key') and not (test.get('fields') or {}).get('summary'):
+        errors['summary'] = 'Summary is required.'
+    if test.get('testtype') == 'Manual' and not test.get('steps'):
+        errors['steps'] = 'Manual tests must have at least one step.'
+    return errors
+
+
+def run_import(tests):
+    result = {'errors': [], 'issues': [], 'warnings': []}
+    for number, test in enumerate(tests):
+        errors = validate(test)
+        if errors:
+            result['errors'].append({'elementNumber': number, 'errors': errors})
+        else:
+            result['issues'].append({'elementNumber': number, 'id': str(next(issue_ids)), 'key': test.get('update_key')})
+    if not result['errors']:
+        status = 'successful'
+    elif result['issues']:
+        status = 'partially_successful'
+    else:
+        status = 'failed'
+    return status, result
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    def send_json(self, status_code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'null')
+
+    def authorized(self):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self.send_json(401, {'error': 'Authentication required'})
+            return False
+        return True
+
+    def do_POST(self):
+        if self.path == '/api/v2/authenticate':
+            self.read_json()
+            self.send_json(200, 'standin-token')
+        elif self.path == '/api/v2/import/test/bulk':
+            if not self.authorized():
+                return
+            tests = self.read_json()
+            if not isinstance(tests, list):
+                self.send_json(400, {'error': 'Expected a JSON array of tests'})
+                return
+            job_id = uuid.uuid4().hex
+            with jobs_lock:
+                jobs[job_id] = {'tests': tests, 'polls': 0}
+            self.send_json(200, {'jobId': job_id})
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 7 or parts[:5] != ['api', 'v2', 'import', 'test', 'bulk'] or parts[6] != 'status':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        if not self.authorized():
+            return
+        with jobs_lock:
+            job = jobs.get(parts[5])
+            if job is None:
+                self.send_json(404, {'error': 'Job not found'})
+                return
+            job['polls'] += 1
+            if job['polls'] <= POLLS_BEFORE_DONE:
+                self.send_json(200, {'status': 'working', 'progress': []})
+                return
+            if 'status' not in job:
+                job['status'], job['result'] = run_import(job['tests'])
+        self.send_json(200, {'status': job['status'], 'result': job['result']})
+
+    def log_message(self, format, *args):
+        print(f"[standin] {self.address_string()} {format % args}")
+
+
+def main():
+    global POLLS_BEFORE_DONE
+    parser = argparse.ArgumentParser(description='Servidor local que emula la importación masiva de Xray Cloud')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--polls', type=int, default=1, help='Consultas de estado en "working" antes de terminar')
+    args = parser.parse_args()
+    POLLS_BEFORE_DONE = args.polls
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StandinHandler)
+    print(f"Stand-in de Xray en http://127.0.0.1:{args.port}/api/v2")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,10 @@ import requests
 import os
 import time
 from dotenv import load_dotenv
-from retry_util import retry_request, make_request, get_thread_local_account, set_thread_local_account, client_delay_info, client_delay_lock
+from retry_util import retry_request, make_request, get_session, get_thread_local_account, set_thread_local_account
+from rate_limiter import get_client_limiter, get_retry_after
+from client_scheduler import ClientScheduler
+from progress_ledger import get_ledger
 import threading
 import json
 import re
@@ -12,74 +15,103 @@ thread_local = threading.local()
 load_dotenv(override=True)
 
 XRAY_BASE_URL = os.getenv('XRAY_BASE_URL')
-CLIENT_IDS = os.getenv('CLIENT_IDS').split(',')
-CLIENT_SECRETS = os.getenv('CLIENT_SECRETS').split(',')
-
+# API REST v2 de Xray Cloud (autenticación e importación masiva); configurable para usar un servidor local
+XRAY_REST_BASE_URL = os.getenv('XRAY_REST_BASE_URL', 'https://xray.cloud.getxray.app/api/v2').rstrip('/')
 RETRIES = 10
 DELAY = 6
 MAX_BACKOFF = 60
-SLEEP_BETWEEN_REQUESTS = 0.1  # Retardo en segundos entre solicitudes
 
-if len(CLIENT_IDS) != len(CLIENT_SECRETS):
-    raise ValueError("Las listas de CLIENT_IDS y CLIENT_SECRETS deben tener la misma longitud")
+# Límites para agrupar mutaciones en un solo documento GraphQL (alias m0, m1, ...)
+MAX_BATCH_PAYLOAD_BYTES = int(os.getenv('XRAY_MAX_BATCH_PAYLOAD_BYTES', 60000))
+MAX_BATCH_MUTATIONS = int(os.getenv('XRAY_MAX_BATCH_MUTATIONS', 50))
+
+clients = None
+scheduler = None
+clients_lock = threading.Lock()
 
-clients = [{'id': id, 'secret': secret, 'token': None, 'last_request_time': 0} for id, secret in zip(CLIENT_IDS, CLIENT_SECRETS)]
-current_client_index = 0
+def get_scheduler():
+    # Los clientes se leen de CLIENT_IDS / CLIENT_SECRETS en el primer uso, no al importar
+    global clients, scheduler
+    with clients_lock:
+        if scheduler is None:
+            client_ids = (os.getenv('CLIENT_IDS') or '').split(',')
+            client_secrets = (os.getenv('CLIENT_SECRETS') or '').split(',')
+            if not all(id.strip() for id in client_ids) or not all(secret.strip() for secret in client_secrets):
+                raise ValueError("CLIENT_IDS y CLIENT_SECRETS deben definir al menos un cliente, sin valores vacíos")
+            if len(client_ids) != len(client_secrets):
+                raise ValueError("Las listas de CLIENT_IDS y CLIENT_SECRETS deben tener la misma longitud")
+            clients = [{'id': id, 'secret': secret, 'token': None, 'last_request_time': 0} for id, secret in zip(client_ids, client_secrets)]
+            scheduler = ClientScheduler(clients)
+    return scheduler
 
 def get_next_client():
-    global current_client_index
-    client = clients[current_client_index]
-    current_client_index = (current_client_index + 1) % len(clients)
-    return client
+    # Cliente con más presupuesto disponible (se debe liberar con release_client)
+    return get_scheduler().acquire()
+
+def release_client(client):
+    get_scheduler().release(client)
+
+def get_client_utilization():
+    return get_scheduler().utilization()
 
 def get_auth_token(client):
-    url = "https://xray.cloud.getxray.app/api/v2/authenticate"
+    url = f"{XRAY_REST_BASE_URL}/authenticate"
     response = retry_request(make_request, client, url, method='POST', json={
         'client_id': client['id'],
         'client_secret': client['secret']
-    }, retries=RETRIES, delay=DELAY)
+    }, client_id=client['id'], retries=RETRIES, delay=DELAY)
     token = response.text.strip('"')
     return token
 
-def send_graphql_request(query, variables=None, client=None):
+def send_graphql_request(query, variables=None, client=None, raise_on_errors=True):
     if client is None:
         client = get_thread_local_account()
 
     if client['token'] is None:
         client['token'] = get_auth_token(client)
 
-    headers = {
-        'Authorization': f'Bearer {client["token"]}',
-        'Content-Type': 'application/json'
-    }
     print(f"Petición con el cliente: {client['id']}")
     payload = {'query': query}
     if variables:
         payload['variables'] = variables
 
+    limiter = get_client_limiter(client['id'])
     attempt = 0
     while attempt < RETRIES:
-        current_time = time.time()
-        time_since_last_request = current_time - client['last_request_time']
-        if time_since_last_request < SLEEP_BETWEEN_REQUESTS:
-            time.sleep(SLEEP_BETWEEN_REQUESTS - time_since_last_request)
+        # Bloquear hasta que el token bucket del cliente permita enviar
+        limiter.acquire()
+
+        headers = {
+            'Authorization': f'Bearer {client["token"]}',
+            'Content-Type': 'application/json'
+        }
 
+        response = None
         try:
-            response = requests.post(XRAY_BASE_URL, headers=headers, json=payload)
+            response = get_session(XRAY_BASE_URL, client['id']).post(XRAY_BASE_URL, headers=headers, json=payload)
             response.raise_for_status()
             client['last_request_time'] = time.time()
             json_response = response.json()
-            if 'errors' in json_response:
+            if 'errors' in json_response and raise_on_errors:
                 print(f"Errores encontrados: {json_response['errors']}")
                 raise Exception(json_response['errors'])
             return json_response
         except requests.exceptions.RequestException as e:
+            if response is None:
+                # Error de conexión sin respuesta (la sesión ya reintentó la conexión)
+                raise e
             if response.status_code == 429:
-                with client_delay_lock:
-                    backoff = client_delay_info[client['id']]['delay']
-                    print(f"Attempt {attempt + 1} failed with error: {response.status_code} {response.reason}. Too Many Requests. Client ID: {client['id']} Retrying in {backoff} seconds...")
-                time.sleep(backoff)
+                backoff = min(get_retry_after(response, DELAY), MAX_BACKOFF)
+                print(f"Attempt {attempt + 1} failed with error: {response.status_code} {response.reason}. Too Many Requests. Client ID: {client['id']} Retrying in {backoff} seconds...")
+                limiter.penalize(backoff)
                 attempt += 1
+                # Si el hilo trabaja con este cliente, pasar a otro con más presupuesto
+                if len(get_scheduler().clients) > 1 and get_thread_local_account() is client:
+                    client = get_scheduler().reassign(client)
+                    set_thread_local_account(client)
+                    if client['token'] is None:
+                        client['token'] = get_auth_token(client)
+                    limiter = get_client_limiter(client['id'])
             elif response.status_code == 401:
                 client['token'] = get_auth_token(client)
             else:
@@ -101,7 +133,11 @@ def getStatusXrayCloud():
     """
     client = get_next_client()
     set_thread_local_account(client)
-    return send_graphql_request(query)
+    try:
+        return send_graphql_request(query)
+    finally:
+        release_client(get_thread_local_account())
+        set_thread_local_account(None)
 
 def escape_definition_text(definition):
     if definition is None:
@@ -114,13 +150,11 @@ def escape_definition_text(definition):
     definition = re.sub(r'[^\x20-\x7E]', '', definition)  # Remove non-printable characters
     return definition
 
-def add_test_step(issue_id, action, data, result):
+def add_test_step_mutation(issue_id, action, data, result):
     escaped_action = escape_definition_text(action)
     escaped_data = escape_definition_text(data)
     escaped_result = escape_definition_text(result)
-    
-    query = f'''
-    mutation {{
+    return f'''
         addTestStep(
             issueId: "{issue_id}",
             step: {{
@@ -134,6 +168,41 @@ def add_test_step(issue_id, action, data, result):
             data
             result
         }}
+    '''
+
+def update_test_type_mutation(issue_id, test_type):
+    return f'''
+        updateTestType(issueId: "{issue_id}", testType: {{name: "{test_type}"}} ) {{
+            issueId
+            testType {{
+                name
+                kind
+            }}
+        }}
+    '''
+
+def update_unstructured_test_definition_mutation(issue_id, unstructured):
+    escaped_unstructured = escape_definition_text(unstructured)
+    return f'''
+        updateUnstructuredTestDefinition(issueId: "{issue_id}", unstructured: "{escaped_unstructured}" ) {{
+            issueId
+            unstructured
+        }}
+    '''
+
+def update_gherkin_test_definition_mutation(issue_id, gherkin):
+    escaped_gherkin = escape_definition_text(gherkin)
+    return f'''
+        updateGherkinTestDefinition(issueId: "{issue_id}", gherkin: "{escaped_gherkin}" ) {{
+            issueId
+            gherkin
+        }}
+    '''
+
+def add_test_step(issue_id, action, data, result):
+    query = f'''
+    mutation {{
+        {add_test_step_mutation(issue_id, action, data, result)}
     }}
     '''
     client = get_thread_local_account()
@@ -147,13 +216,7 @@ def add_test_step(issue_id, action, data, result):
 def update_test_type(issue_id, test_type):
     query = f'''
     mutation {{
-        updateTestType(issueId: "{issue_id}", testType: {{name: "{test_type}"}} ) {{
-            issueId
-            testType {{
-                name
-                kind
-            }}
-        }}
+        {update_test_type_mutation(issue_id, test_type)}
     }}
     '''
     client = get_thread_local_account()
@@ -165,13 +228,9 @@ def update_test_type(issue_id, test_type):
         raise e
 
 def update_unstructured_test_definition(issue_id, unstructured):
-    escaped_unstructured = escape_definition_text(unstructured)
     query = f'''
     mutation {{
-        updateUnstructuredTestDefinition(issueId: "{issue_id}", unstructured: "{escaped_unstructured}" ) {{
-            issueId
-            unstructured
-        }}
+        {update_unstructured_test_definition_mutation(issue_id, unstructured)}
     }}
     '''
     client = get_thread_local_account()
@@ -183,13 +242,9 @@ def update_unstructured_test_definition(issue_id, unstructured):
         raise e
 
 def update_gherkin_test_definition(issue_id, gherkin):
-    escaped_gherkin = escape_definition_text(gherkin)
     query = f'''
     mutation {{
-        updateGherkinTestDefinition(issueId: "{issue_id}", gherkin: "{escaped_gherkin}" ) {{
-            issueId
-            gherkin
-        }}
+        {update_gherkin_test_definition_mutation(issue_id, gherkin)}
     }}
     '''
     client = get_thread_local_account()
@@ -200,6 +255,84 @@ def update_gherkin_test_definition(issue_id, gherkin):
         log_error(issue_id, f"Error updating gherkin test definition: {e}")
         raise e
 
+def _split_mutation_batches(mutations, max_payload_bytes, max_mutations):
+    # Agrupa los fragmentos (con alias) en documentos que no superen el límite de tamaño
+    batches = []
+    current = []
+    current_size = len('mutation {  }')
+    for index, mutation in enumerate(mutations):
+        field = f"m{index}: {mutation.strip()}"
+        field_size = len(field.encode('utf-8')) + 1
+        if current and (current_size + field_size > max_payload_bytes or len(current) >= max_mutations):
+            batches.append(current)
+            current = []
+            current_size = len('mutation {  }')
+        current.append((index, f"m{index}", field))
+        current_size += field_size
+    if current:
+        batches.append(current)
+    return batches
+
+def send_graphql_batch(mutations, client=None, max_payload_bytes=None, max_mutations=None, continue_on_error=False):
+    # Envía varias mutaciones en uno o más documentos GraphQL usando alias.
+    # Devuelve una lista (en el mismo orden) de {'data': ..., 'errors': [...]} por mutación.
+    # Los documentos se envían en orden y se para en el primero que falla: las mutaciones
+    # de los siguientes quedan con error sin enviarse. continue_on_error=True envía todos
+    # los documentos (mutaciones independientes entre sí).
+    if max_payload_bytes is None:
+        max_payload_bytes = MAX_BATCH_PAYLOAD_BYTES
+    if max_mutations is None:
+        max_mutations = MAX_BATCH_MUTATIONS
+    if client is None:
+        client = get_thread_local_account()
+
+    results = [{'data': None, 'errors': []} for _ in mutations]
+    batches = _split_mutation_batches(mutations, max_payload_bytes, max_mutations)
+    for number, batch in enumerate(batches):
+        query = "mutation {\n" + "\n".join(field for _, _, field in batch) + "\n}"
+        alias_to_index = {alias: index for index, alias, _ in batch}
+        try:
+            response = send_graphql_request(query, client=client, raise_on_errors=False)
+        except Exception as e:
+            # Fallo de transporte: todas las mutaciones del lote quedan con error
+            for index, _, _ in batch:
+                results[index]['errors'].append(str(e))
+            response = None
+
+        if response is not None:
+            data = response.get('data') or {}
+            for alias, index in alias_to_index.items():
+                results[index]['data'] = data.get(alias)
+
+            for error in response.get('errors', []):
+                path = error.get('path') or []
+                if path and path[0] in alias_to_index:
+                    results[alias_to_index[path[0]]]['errors'].append(error.get('message', error))
+                else:
+                    # Error sin path: se asigna a las mutaciones del lote que no devolvieron datos
+                    for alias, index in alias_to_index.items():
+                        if results[index]['data'] is None:
+                            results[index]['errors'].append(error.get('message', error))
+
+        if not continue_on_error and any(results[index]['errors'] for index, _, _ in batch):
+            for later in batches[number + 1:]:
+                for index, _, _ in later:
+                    results[index]['errors'].append("not attempted: previous batch failed")
+            break
+    return results
+
+def send_test_mutations(issue_id, mutations, client=None):
+    # mutations: lista de (descripción, fragmento). Los errores se registran por mutación.
+    results = send_graphql_batch([mutation for _, mutation in mutations], client=client)
+    failed = []
+    for (description, _), result in zip(mutations, results):
+        if result['errors']:
+            log_error(issue_id, f"Error {description}: {result['errors']}")
+            failed.append(f"{description}: {result['errors']}")
+    if failed:
+        raise Exception(f"{len(failed)} de {len(mutations)} mutaciones fallaron: {failed}")
+    return [result['data'] for result in results]
+
 def update_precondition(precondition_id, precondition_type, precondition_definition):
     escaped_precondition_type = escape_definition_text(precondition_type)
     escaped_precondition_definition = escape_definition_text(precondition_definition)
@@ -247,30 +380,11 @@ def add_preconditions_to_test(test_id, precondition_ids):
         raise e
 
 def log_error(test_key, error_message):
-    log_file = 'logs/ErrorTestCase.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            errors = json.load(f)
-    else:
-        errors = []
-
-    errors.append({'key': test_key, 'error': error_message})
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(errors, f, indent=4)
+    # Errores de transporte por issue id: solo historial, el estado del test lo lleva test_processor
+    get_ledger().record_error('test', test_key, error_message)
 
 def log_precondition_error(precondition_key, error_message):
-    log_file = 'logs/preconditionError.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            errors = json.load(f)
-    else:
-        errors = []
-
-    errors.append({'key': precondition_key, 'error': error_message})
-
-    with open(log_file, 'w', encoding='utf-8') as f:
-        json.dump(errors, f, indent=4)
+    get_ledger().record_error('precondition', precondition_key, error_message)
 
 
 def add_test_sets_to_test(issue_id, test_set_ids):
@@ -292,14 +406,30 @@ def add_test_sets_to_test(issue_id, test_set_ids):
         response = send_graphql_request(query, client=client)
         return response
     except Exception as e:
-        log_precondition_error(test_id, f"Error adding preconditions to test: {e}")
+        log_error(issue_id, f"Error adding test sets to test: {e}")
         raise e
 
-def getTestCasesUpdated(keys):
+def add_tests_to_test_set_mutation(test_set_id, test_ids):
+    return f'''
+        addTestsToTestSet(issueId: "{test_set_id}", testIssueIds: {json.dumps(test_ids)}) {{
+            addedTests
+            warning
+        }}
+    '''
+
+def add_tests_to_precondition_mutation(precondition_id, test_ids):
+    return f'''
+        addTestsToPrecondition(issueId: "{precondition_id}", testIssueIds: {json.dumps(test_ids)}) {{
+            addedTests
+            warning
+        }}
+    '''
+
+def build_test_cases_updated_query(keys):
     # Unir las claves en una cadena separada por comas
     keys_str = ','.join(keys)
     
-    query = f'''
+    return f'''
         {{
         getTests(jql: "key in ({keys_str})", limit: 100) {{
             total
@@ -320,16 +450,30 @@ def getTestCasesUpdated(keys):
                 }}
                 gherkin
                 unstructured
+                preconditions(limit: 100) {{
+                    results {{
+                        issueId
+                    }}
+                }}
+                testSets(limit: 100) {{
+                    results {{
+                        issueId
+                    }}
+                }}
                 jira(fields: [ "key"])
             }}
         }}
     }}
     '''
+
+def getTestCasesUpdated(keys):
+    query = build_test_cases_updated_query(keys)
     print(query)
     
-    # Obtener cliente, si es None, obtener el siguiente cliente disponible
+    # Obtener cliente, si es None, pedir al scheduler el de más presupuesto solo para esta consulta
     client = get_thread_local_account()
-    if client is None:
+    borrowed = client is None
+    if borrowed:
         client = get_next_client()
         set_thread_local_account(client)
     
@@ -338,4 +482,48 @@ def getTestCasesUpdated(keys):
         return response
     except Exception as e:
         print(f"Error retrieving test cases: {e}")
-        raise e
\ No newline at end of file
+        raise e
+    finally:
+        if borrowed:
+            release_client(get_thread_local_account())
+            set_thread_local_account(None)
+
+TESTS_MODIFIED_SINCE_QUERY = '''
+    query($jql: String!, $start: Int, $limit: Int) {
+        getTests(jql: $jql, start: $start, limit: $limit) {
+            total
+            start
+            limit
+            results {
+                lastModified
+                jira(fields: ["key"])
+            }
+        }
+    }
+'''
+
+def getTestsModifiedSince(jql, limit=100):
+    # Devuelve {key: lastModified} de los tests de cloud que cumplen el JQL (p. ej. updated >= ...)
+    client = get_thread_local_account()
+    borrowed = client is None
+    if borrowed:
+        client = get_next_client()
+        set_thread_local_account(client)
+
+    modified = {}
+    start = 0
+    try:
+        while True:
+            response = send_graphql_request(TESTS_MODIFIED_SINCE_QUERY,
+                                            variables={'jql': jql, 'start': start, 'limit': limit},
+                                            client=get_thread_local_account())
+            page = response['data']['getTests']
+            for testcase in page['results']:
+                modified[testcase['jira']['key']] = testcase['lastModified']
+            start += len(page['results'])
+            if not page['results'] or start >= page['total']:
+                return modified
+    finally:
+        if borrowed:
+            release_client(get_thread_local_account())
+            set_thread_local_account(None)